@@ -0,0 +1,237 @@
+"""
+Single command line entry point for the scraping pipeline:
+
+    python3 sbnation.py list --archives-url https://www.barcablaugranes.com/archives/ --years 2019 \\
+        --out scrapped_data/bb/bb_article_list.json
+    python3 sbnation.py content --infos scrapped_data/bb/bb_article_list.json --out scrapped_data/bb/bb_articles
+    python3 sbnation.py compile --articles scrapped_data/bb/bb_articles --out scrapped_data/bb/bb_text_all.txt
+    python3 sbnation.py stats scrapped_data/bb/bb_article_list.json scrapped_data/bb/bb_articles
+
+Every subcommand only imports the modules (and so the heavy dependencies like selenium, requests,
+bs4 or numpy) it needs, and logging is configured once here. main() can be called repeatedly,
+e.g. from a batch job, every call is an independent run.
+"""
+import argparse
+import sys
+import logging
+from pprint import pformat
+
+from sbnation_logging import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_range(text):
+    """
+    "2019" -> range(2019, 2020), "2017-2019" -> range(2017, 2020)
+    """
+    first, _, last = text.partition('-')
+    try:
+        return range(int(first), int(last or first) + 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} is not a number or a first-last range".format(text))
+
+
+def parse_author_output(text):
+    """
+    "Lucas Navarrete=mm_text_lucas.txt" -> ("Lucas Navarrete", "mm_text_lucas.txt")
+    """
+    author, separator, path = text.rpartition('=')
+    if not separator or not author or not path:
+        raise argparse.ArgumentTypeError("{} is not AUTHOR=PATH".format(text))
+    return author, path
+
+
+def _response_cache(args):
+    if args.cache is None:
+        return None
+    from sbnation_http_cache import ResponseCache
+    return ResponseCache(args.cache, offline=args.offline)
+
+
+def run_list(args):
+    from sbnation_article_list_scraper import get_existing_articles_list
+    article_infos = get_existing_articles_list(fname=args.out)
+    if args.browser is not None:
+        from sbnation_article_list_scraper import scrape_from_sbnation
+        scrape_from_sbnation(args.months, args.years, outfile_path=args.out, existing_article_infos=article_infos,
+            webdriver_executable_path=args.browser, archives_root_url=args.archives_url,
+            incremental=args.incremental)
+    else:
+        from sbnation_archive_crawler import scrape_from_sbnation_http
+        scrape_from_sbnation_http(args.months, args.years, outfile_path=args.out,
+            existing_article_infos=article_infos, archives_root_url=args.archives_url,
+            requests_per_second=args.rps, max_pages=args.max_pages, backend=args.backend,
+            cache=_response_cache(args), incremental=args.incremental, retries=args.retries)
+
+
+def run_content(args):
+    from sbnation_article_content_scraper import get_existing_articles, scrap_content
+    from sbnation_article_list_scraper import get_existing_article_info_table
+    from sbnation_article_store import is_article_store
+    article_infos = get_existing_article_info_table(args.infos)
+    articles = get_existing_articles(args.out, load_bodies=not is_article_store(args.out))
+    cache = _response_cache(args)
+    if args.pipelined:
+        from sbnation_pipeline import scrap_content_pipelined
+        scrap_content_pipelined(article_infos, articles, args.out, fetch_workers=args.workers,
+            parse_processes=args.parse_processes, requests_per_second=args.rps, backend=args.backend, cache=cache)
+        return
+    from sbnation_http import Fetcher
+    fetcher = Fetcher(workers=args.workers, requests_per_second=args.rps, cache=cache, retries=args.retries)
+    ledger = None
+    if args.ledger is not None:
+        from sbnation_job_ledger import JobLedger
+        ledger = JobLedger(args.ledger)
+    try:
+        scrap_content(article_infos, articles, args.out, workers=args.workers, backend=args.backend,
+            fetcher=fetcher, ledger=ledger, retry_failed_only=args.retry_failed_only)
+    finally:
+        if ledger is not None:
+            ledger.close()
+
+
+def run_compile(args):
+    outputs = dict(args.author)
+    if args.out is not None:
+        outputs[None] = args.out
+    if outputs:
+        from sbnation_text_file_compiler import compile_txt_files
+        compile_txt_files(args.articles, outputs)
+    if args.tokens is not None:
+        from sbnation_token_dataset import compile_token_dataset
+        compile_token_dataset(args.articles, args.tokens, tokenizer=args.tokenizer, processes=args.processes,
+            val_fraction=args.val_fraction)
+
+
+def _is_articles_file(path):
+    """
+    True for articles (an article store, or a json file whose entries have content),
+    False for an article list
+    """
+    from sbnation_article_store import is_article_store, iter_json_object_items
+    if is_article_store(path):
+        return True
+    for _, value in iter_json_object_items(path):
+        return 'content' in value
+    return False
+
+
+def _counts(path):
+    from sbnation_article_table import ArticleInfoTable, count_by_month_and_author
+    if _is_articles_file(path):
+        from sbnation_article_store import open_article_index
+        # the index only holds the metadata, for json files it is kept next to them and reused by the next run
+        dates, authors = [], []
+        for _, value in open_article_index(path).items():
+            dates.append(value['date'])
+            authors.append(value['author'])
+        return "articles", len(dates), count_by_month_and_author(dates, authors)
+    try:
+        table = ArticleInfoTable.from_json(path)
+    except ValueError:
+        # old hash keys, the article list has to be loaded and rekeyed first
+        from sbnation_article_list_scraper import get_existing_articles_list
+        table = ArticleInfoTable.from_dict(get_existing_articles_list(path))
+    return "article infos", len(table), table.counts()
+
+
+def run_stats(args):
+    for path in args.paths:
+        kind, total, (month_counts, author_counts) = _counts(path)
+        print("{}: {} {}".format(path, total, kind))
+        print("Month counts")
+        print(pformat(dict(month_counts), indent=2, compact=True))
+        print("Author counts")
+        print(pformat(dict(author_counts), indent=2, compact=True))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="sbnation", description="Scrape SB Nation articles and compile them")
+    parser.add_argument('--log-file', default="sbnation.log", help="debug log, appended to (default: %(default)s)")
+    parser.add_argument('--no-log-file', action='store_true', help="only log to the console")
+    parser.add_argument('-v', '--verbose', action='store_true', help="also print debug messages")
+    parser.add_argument('--metrics', action='append', metavar='PATH', help="write the run metrics to PATH "
+        "every 10s (.prom for Prometheus, json otherwise), can be repeated")
+    parser.add_argument('--profile', metavar='PATH', help="run under cProfile and save the stats to PATH")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help="scrape the article lists from the archives")
+    list_parser.add_argument('--archives-url', required=True, help="e.g. https://www.barcablaugranes.com/archives/")
+    list_parser.add_argument('--out', required=True, help="article list json file, extended if it exists")
+    list_parser.add_argument('--years', required=True, type=parse_range, help="2019 or 2017-2019")
+    list_parser.add_argument('--months', default=range(1, 13), type=parse_range, help="default: 1-12")
+    list_parser.add_argument('--incremental', action='store_true',
+        help="only pick up the articles published since the newest one in --out")
+    list_parser.add_argument('--browser', metavar='CHROMEDRIVER',
+        help="use selenium with this chromedriver instead of plain http requests")
+    list_parser.add_argument('--rps', type=float, help="maximum requests per second")
+    list_parser.add_argument('--max-pages', type=int, default=100, help="maximum archive pages per month")
+    list_parser.add_argument('--retries', type=int, default=3, help="retries of timeouts and 5xx answers")
+    list_parser.add_argument('--backend', default="html.parser", help="html.parser, lxml or selectolax")
+    list_parser.add_argument('--cache', metavar='DIR', help="on disk http response cache")
+    list_parser.add_argument('--offline', action='store_true', help="only use the pages in --cache")
+    list_parser.set_defaults(run=run_list)
+
+    content_parser = subparsers.add_parser('content', help="scrape the articles of an article list")
+    content_parser.add_argument('--infos', required=True, help="article list json file")
+    content_parser.add_argument('--out', required=True,
+        help="article store directory, or a .json file which is rewritten at every checkpoint")
+    content_parser.add_argument('--workers', type=int, default=8, help="concurrent fetches (default: %(default)s)")
+    content_parser.add_argument('--rps', type=float, default=4, help="maximum requests per second per host")
+    content_parser.add_argument('--retries', type=int, default=3, help="retries of timeouts and 5xx answers")
+    content_parser.add_argument('--backend', default="html.parser", help="html.parser, lxml or selectolax")
+    content_parser.add_argument('--cache', metavar='DIR', help="on disk http response cache")
+    content_parser.add_argument('--offline', action='store_true', help="only use the pages in --cache")
+    content_parser.add_argument('--ledger', metavar='PATH', help="sqlite job ledger, only outstanding articles "
+        "are gone through on a resume")
+    content_parser.add_argument('--retry-failed-only', action='store_true', help="only retry the failed articles "
+        "of --ledger")
+    content_parser.add_argument('--pipelined', action='store_true', help="parse in a pool of processes")
+    content_parser.add_argument('--parse-processes', type=int, help="with --pipelined (default: number of cores)")
+    content_parser.set_defaults(run=run_content)
+
+    compile_parser = subparsers.add_parser('compile', help="compile articles into training files")
+    compile_parser.add_argument('--articles', required=True, help="article store directory or articles json file")
+    compile_parser.add_argument('--out', help="text file with the articles of all authors")
+    compile_parser.add_argument('--author', type=parse_author_output, action='append', default=[],
+        metavar='AUTHOR=PATH', help="text file with the articles of one author, can be repeated")
+    compile_parser.add_argument('--tokens', metavar='PREFIX', help="also write a pre-tokenized dataset")
+    compile_parser.add_argument('--tokenizer', default="bytes", help="with --tokens: bytes or gpt2")
+    compile_parser.add_argument('--processes', type=int, help="with --tokens: tokenizer processes")
+    compile_parser.add_argument('--val-fraction', type=float, default=0.01, help="with --tokens")
+    compile_parser.set_defaults(run=run_compile)
+
+    stats_parser = subparsers.add_parser('stats', help="article counts per month and author")
+    stats_parser.add_argument('paths', nargs='+', help="article list json files, articles json files or stores")
+    stats_parser.set_defaults(run=run_stats)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'content' and args.pipelined and (args.ledger or args.retry_failed_only):
+        parser.error("--ledger and --retry-failed-only do not work with --pipelined")
+    if args.command in ('list', 'content') and args.offline and args.cache is None:
+        parser.error("--offline needs --cache")
+    if args.command == 'list' and args.offline and args.browser is not None:
+        parser.error("--offline does not work with --browser")
+    if args.command == 'compile' and args.out is None and not args.author and args.tokens is None:
+        parser.error("compile needs at least one of --out, --author or --tokens")
+
+    setup_logging(log_file=None if args.no_log_file else args.log_file,
+        console_level=logging.DEBUG if args.verbose else logging.INFO)
+    if args.metrics is None and args.profile is None:
+        args.run(args)
+        return 0
+    from sbnation_metrics import MetricsExporter, metrics, profiled
+    # every run exports its own metrics
+    metrics.reset()
+    with MetricsExporter(args.metrics or []), profiled(args.profile):
+        args.run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
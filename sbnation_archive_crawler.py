@@ -0,0 +1,136 @@
+import logging
+import requests
+from sbnation_logging import setup_logging
+from sbnation_article_list_scraper import (
+    add_entries_to_dictionary, all_known, get_existing_articles_list, months_to_crawl, newest_known_month
+)
+from sbnation_article_store import dump_json
+from sbnation_dedupe import ArticleKeySet
+from sbnation_html_extraction import extract_archive_entries
+from sbnation_http import AdaptiveThrottle, Fetcher
+from sbnation_http_cache import CacheMiss
+from sbnation_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def archive_page_url(archives_root_url, year, month, page=1):
+    """
+    The first archive page of a month lives at archives/<year>/<month>,
+    the following ones (what the load more button fetches) at archives/<year>/<month>/<page>
+    """
+    url = archives_root_url + str(year) + "/" + str(month)
+    if page > 1:
+        url += "/" + str(page)
+    return url
+
+
+def crawl_archive_month(month, year, fetcher, archives_root_url, existing_article_infos, max_pages=100,
+    backend="html.parser", stop_at_known=False, known_keys=None):
+    """
+    Requests the archive pages of a month one after the other, without a browser,
+    and adds the entries on them to existing_article_infos the same way extract_links_from_html does.
+    Stops at the first page which is missing, empty or only repeats entries already seen this month
+    :param: stop_at_known : also stop at the first page whose entries are all in existing_article_infos
+    already (the archives list the newest articles first, so the following pages are known too)
+    :param: known_keys : optional sbnation_dedupe.ArticleKeySet of the keys in existing_article_infos
+    before the run, see add_to_dictionary
+    """
+    seen_links = set()
+    for page in range(1, max_pages + 1):
+        url = archive_page_url(archives_root_url, year, month, page)
+        try:
+            response = fetcher.get(url)
+        except CacheMiss:
+            # only 200 answers are cached, so offline the missing page after the last one is a miss
+            logger.debug("{} is not in the offline cache, done with {}-{}".format(url, year, month))
+            break
+        if response.status_code != 200:
+            logger.debug("Got status {} for {}, done with {}-{}".format(response.status_code, url, year, month))
+            break
+        entries = extract_archive_entries(response.content, backend)
+        metrics.inc('archive_pages')
+        links = [address for title, address, author, _date in entries]
+        if not links and page == 1 and fetcher.throttle is not None:
+            # the website returns blank pages when it wants us to 'go slow on archives'
+            fetcher.throttle.record_block(url, "empty archive page")
+        if not links or seen_links.issuperset(links):
+            logger.debug("No new entries on {}, done with {}-{}".format(url, year, month))
+            break
+        if stop_at_known and all_known(links, existing_article_infos if known_keys is None else known_keys):
+            logger.debug("Only known entries on {}, done with {}-{}".format(url, year, month))
+            metrics.inc('archive_early_stops')
+            break
+        seen_links.update(links)
+        existing_article_infos = add_entries_to_dictionary(entries, existing_article_infos, known_keys=known_keys)
+    else:
+        logger.warning("Reached max_pages={} for {}-{}, there may be more entries".format(max_pages, year, month))
+    return existing_article_infos
+
+
+def scrape_from_sbnation_http(months, years,
+    outfile_path, existing_article_infos,
+    archives_root_url, requests_per_second=None, max_pages=100, throttle=None, backend="html.parser",
+    cache=None, incremental=False, retries=3):
+    """
+    Scrapes the article lists from the archives of a Sports Nation Website using plain http requests,
+    as an alternative to the selenium based scrape_from_sbnation
+    :param: requests_per_second : optional hard cap on the request rate
+    :param: throttle : AdaptiveThrottle pacing the requests, a new one starting at
+    one request every 0.5s is used by default
+    :param: backend : parser backend, see sbnation_html_extraction
+    :param: cache : optional sbnation_http_cache.ResponseCache for the archive pages
+    :param: incremental : only pick up the articles published since the last run, i.e. skip the months
+    before the newest month in existing_article_infos and stop paginating at the first page
+    of already known articles
+    :param: retries : number of times a timed out, refused or 5xx archive page request is retried.
+    A month whose pages still fail is logged and skipped, the list is written after every month
+    """
+    if throttle is None:
+        throttle = AdaptiveThrottle(delay=0.5)
+    fetcher = Fetcher(requests_per_second=requests_per_second, throttle=throttle, cache=cache, retries=retries)
+    since = newest_known_month(existing_article_infos) if incremental else None
+    if since is not None:
+        logger.info("Incremental refresh, crawling the months since {}-{}".format(*since))
+    known_keys = ArticleKeySet(existing_article_infos)
+    try:
+        for year, month in months_to_crawl(months, years, since):
+            try:
+                existing_article_infos = crawl_archive_month(
+                    month, year, fetcher, archives_root_url, existing_article_infos, max_pages=max_pages,
+                    backend=backend, stop_at_known=incremental, known_keys=known_keys
+                )
+            except requests.RequestException as error:
+                # the entries of the pages before the error are kept
+                logger.error("Couldnt crawl the archives of {}-{}: {}".format(year, month, error))
+                metrics.inc('archive_month_errors', reason=type(error).__name__)
+                continue
+            logger.info("Processed articles for (year-month = {}-{}) No. of articles now = {}"
+                .format(year, month, len(existing_article_infos)))
+            dump_json(existing_article_infos, outfile_path)
+        logger.info("Done processing articles")
+        logger.info("Final request rate {:.2f}/s, {} block events".format(throttle.rate, len(throttle.block_events)))
+    finally:
+        logger.info("Writing json to {} file".format(outfile_path))
+        dump_json(existing_article_infos, outfile_path)
+    return existing_article_infos
+
+"""
+Change these parameters to scrape article links list you are interested in
+Does not need a browser or a webdriver
+"""
+if __name__ == '__main__':
+    setup_logging()
+    outfile_path = "scrapped_data/bb/bb_article_list.json"
+    archives_root_url = "https://www.barcablaugranes.com/archives/"
+    article_infos = get_existing_articles_list(fname=outfile_path)
+    months = range(1, 10, 1)
+    years = range(2019, 2020, 1)
+    scrape_from_sbnation_http(
+        months, years,
+        existing_article_infos = article_infos,
+        outfile_path = outfile_path,
+        archives_root_url = archives_root_url,
+        # set to True for a quick refresh which only picks up the articles published since the last run
+        incremental = False
+    )
@@ -1,57 +1,34 @@
-from bs4 import BeautifulSoup
 import json
-import requests
 import os.path
 import logging
-from sbnation_article_list_scraper import get_existing_articles_list
-from collections import defaultdict
-from datetime import datetime
+from sbnation_logging import setup_logging
+from sbnation_article_list_scraper import get_existing_article_info_table
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
-
-# create logger with 'this modules name'
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# create file handler which logs even debug messages
-fh = logging.handlers.RotatingFileHandler(__name__+'.log', 
-mode='w', maxBytes=1e7, backupCount=4)
-fh.setLevel(logging.DEBUG)
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-
-# create a detailed and simple formatter and add it to the handlers
-detailed_formatter = logging.Formatter(fmt=
-    ("%(asctime)-22s - %(name)-4s - %(levelname)-4s - "
-    "%(filename)-5s - %(lineno)-2s - "
-    "%(funcName)-5s \n%(message)s")
+import requests
+from sbnation_http import Fetcher
+from sbnation_dedupe import has_legacy_keys, migrate_keys
+from sbnation_http_cache import CacheMiss
+from sbnation_metrics import MetricsExporter, metrics, profiled
+from sbnation_html_extraction import extract_article
+from sbnation_job_ledger import JobLedger
+from sbnation_article_table import count_by_month_and_author
+from sbnation_article_store import (
+    ArticleIndex, ArticleStore, is_article_store, open_article_index
 )
-simple_formatter = logging.Formatter('%(name)s: %(levelname)s: %(message)s')
 
-fh.setFormatter(detailed_formatter)
-ch.setFormatter(simple_formatter)
-# add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
-
-# root logger - when used as logging.info() for example instead of logger.info()
-# logging.basicConfig(level=logging.DEBUG, handlers=[fh, ch])
+logger = logging.getLogger(__name__)
 
 # Each article_info (article_list) dictionary contains the following data
-# hash(author, title, date) : author, title, date, url
+# article_key(url) : author, title, date, url (see sbnation_dedupe)
 # Each article dictionary additionaly contains the 'content' key:value pair
 def print_articles_summary_details(dic):
     """
     Log some summary details for the dictionary containing articles
     """
-    mm_datetime_format = "%Y-%m-%dT%H:%M:%S+00:00"
-    yearmonth_format = "%Y%m"
-    author_counts = defaultdict(int)
-    month_counts = defaultdict(int)
-    for value in dic.values():
-        _datetime = datetime.strptime(value['date'], mm_datetime_format)
-        month_counts[_datetime.strftime(yearmonth_format)] += 1
-        author_counts[value['author']] += 1
+    month_counts, author_counts = count_by_month_and_author(
+        [value['date'] for value in dic.values()], [value['author'] for value in dic.values()])
 
     logger.debug("Author article counts")
     logger.debug(pformat(author_counts, indent=2, compact=True))
@@ -59,14 +36,33 @@ def print_articles_summary_details(dic):
     logger.info(pformat(month_counts, indent=2, compact=True))
 
 
-def get_existing_articles(fname):
+def get_existing_articles(fname, load_bodies=True):
     """
     Load existing articles into the memory (so as not to overwrite them)
+    fname can either be a json file or an article store directory
+    :param: load_bodies : if False, only an ArticleIndex with the metadata of the articles
+    is loaded, which is all scrap_content needs to resume into an article store. The index is
+    returned for an empty or missing store too, so a first run only keeps the articles which
+    are not checkpointed yet in memory
     """
-    if os.path.isfile(fname):
+    if os.path.isfile(fname) or os.path.isdir(fname):
         articles = {}
-        with open(fname, 'r') as articles_file:
-            articles = json.load(articles_file)
+        if not load_bodies:
+            articles = open_article_index(fname)
+        elif os.path.isdir(fname):
+            articles = ArticleStore(fname).load()
+        else:
+            with open(fname, 'r') as articles_file:
+                articles = json.load(articles_file)
+        if not articles:
+            logger.info("Article store {} is empty".format(fname))
+            return {} if load_bodies else articles
+        if has_legacy_keys(articles):
+            if not load_bodies:
+                raise ValueError("Articles in {} use the old hash keys, "
+                    "migrate them with sbnation_dedupe.migrate_file first".format(fname))
+            logger.info("Articles in {} use the old hash keys, rekeying them by url".format(fname))
+            articles = migrate_keys(articles)
         logger.info("Total Current number of articles = {}".format(len(articles)))
         _first_key = list(articles.keys())[0]
         logger.debug("First entry : {}".format(articles[_first_key]))
@@ -74,7 +70,7 @@ def get_existing_articles(fname):
         return articles
     else:
         logger.info("Couldnt find any existing articles")
-        return {}
+        return ArticleStore(fname).index() if not load_bodies and is_article_store(fname) else {}
 
 # Print iterations progress
 def print_progress_bar (iteration, total, prefix = '', suffix = '', decimals = 1, length = 100, fill = '.'):
@@ -89,8 +85,10 @@ def print_progress_bar (iteration, total, prefix = '', suffix = '', decimals = 1
         length      - Optional  : character length of bar (Int)
         fill        - Optional  : bar fill character (Str)
     """
-    percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-    filled_length = int(length * iteration // total)
+    # nothing to do (e.g. nothing outstanding in the job ledger) counts as complete
+    fraction = iteration / float(total) if total else 1.0
+    percent = ("{0:." + str(decimals) + "f}").format(100 * fraction)
+    filled_length = int(length * fraction)
     bar = fill * filled_length + '-' * (length - filled_length)
     print('\r%s |%s| %s%% %s\n' % (prefix, bar, percent, suffix), end='')
     # Print New Line on Complete
@@ -105,61 +103,214 @@ def add_article(articles, key, date, title, url, author, body, summary):
     return articles
 
 
-def write_articles_to_file(articles, outfile_path):
-    with open(outfile_path, 'w') as outfile:
-        json.dump(articles, outfile)
+class ArticleSkipped(Exception):
+    """
+    Raised when an article page cannot be turned into an article, reason is a short metrics label
+    """
+    def __init__(self, url, reason):
+        super(ArticleSkipped, self).__init__("Skipped {} ({})".format(url, reason))
+        self.reason = reason
 
 
-def scrap_content(article_infos, articles, outfile_path):
+def article_fields(value, status_code, extracted):
+    """
+    Decides the author, body and summary of an article from its article_info value and the
+    values extracted from its page. summary is None if the page has none
+    """
+    author = value['author']
+    if author=="unknown":
+        author = extracted['author']
+    body = extracted['body']
+    if author is None or body is None:
+        if status_code != 200:
+            raise ArticleSkipped(value['url'], "status_{}".format(status_code))
+        raise ArticleSkipped(value['url'], "no_author" if author is None else "no_body")
+    return author, body, extracted['summary']
+
+
+def write_articles_to_file(articles, outfile_path, new_keys=None):
+    """
+    Save articles to outfile_path. If outfile_path is an article store, only the articles
+    in new_keys (the ones added since the last write) are appended to it,
+    otherwise the whole dictionary is dumped as json
+    """
+    with metrics.timer('checkpoint'):
+        _write_articles_to_file(articles, outfile_path, new_keys)
+
+
+def _write_articles_to_file(articles, outfile_path, new_keys):
+    if is_article_store(outfile_path):
+        store = ArticleStore(outfile_path)
+        for key in (new_keys if new_keys is not None else articles):
+            store.append(key, articles[key])
+        entries = store.commit()
+        if isinstance(articles, ArticleIndex):
+            # the committed articles are read back from the store when needed
+            articles.mark_stored(entries)
+    else:
+        with open(outfile_path, 'w') as outfile:
+            json.dump(articles, outfile)
+
+
+def fetch_article(fetcher, url):
+    """
+    Returns the response for url, or an ArticleSkipped (instead of raising it) for urls missing
+    from an offline cache and for requests which failed, so that one bad url does not stop a run
+    """
+    try:
+        return fetcher.get(url)
+    except CacheMiss:
+        logger.debug("{} is not in the offline cache".format(url))
+        return ArticleSkipped(url, "cache_miss")
+    except requests.RequestException as error:
+        logger.warning("Couldnt fetch {}: {}".format(url, error))
+        return ArticleSkipped(url, "fetch_error")
+
+
+def iter_responses(fetcher, urls, workers=1):
+    """
+    Yields the responses for urls, in the same order as urls.
+    With more than one worker, up to 2*workers requests are kept in flight ahead of the consumer
+    """
+    if workers <= 1:
+        for url in urls:
+            yield fetch_article(fetcher, url)
+        return
+    executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight = deque()
+    urls = iter(urls)
+    try:
+        for url in urls:
+            in_flight.append(executor.submit(fetch_article, fetcher, url))
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            response = in_flight.popleft().result()
+            for url in urls:
+                in_flight.append(executor.submit(fetch_article, fetcher, url))
+                break
+            yield response
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def scrap_content(article_infos, articles, outfile_path,
+    workers=1, requests_per_second=None, burst=1, throttle=None, backend="html.parser", cache=None,
+    fetcher=None, ledger=None, retry_failed_only=False):
+    """
+    Fetches and extracts the content of every article in article_infos which is not yet in articles
+    :param: workers : number of concurrent fetches, the resulting articles dictionary is
+    identical to the one produced by a serial run
+    :param: requests_per_second : per host rate limit shared by all workers (None = unlimited)
+    :param: burst : number of requests per host allowed back to back before rate limiting
+    :param: throttle : optional AdaptiveThrottle, slows down when the website starts refusing requests
+    :param: backend : html parser backend, 'html.parser', 'lxml' or 'selectolax' (see sbnation_html_extraction)
+    :param: cache : optional sbnation_http_cache.ResponseCache, use an offline cache to re-extract
+    already downloaded articles without touching the network
+    :param: fetcher : optional sbnation_http.Fetcher shared with other scrapes (e.g. of the same website),
+    used instead of building one from requests_per_second, burst, throttle and cache
+    :param: ledger : optional sbnation_job_ledger.JobLedger. Only the articles it lists as pending
+    or due for a retry are gone through, and every success or failure (with its reason) is recorded
+    :param: retry_failed_only : with a ledger, only retry the failed articles
+    If outfile_path is an article store (see sbnation_article_store) checkpoints only append
+    the new articles, otherwise the whole json file is rewritten every time
+    articles can be an ArticleIndex (see get_existing_articles) when writing to an article store
+    """
+    if isinstance(articles, ArticleIndex) and not is_article_store(outfile_path):
+        raise ValueError("Writing to json file {} needs all the articles loaded, "
+            "use an article store or load_bodies=True".format(outfile_path))
+    if fetcher is None:
+        fetcher = Fetcher(workers=workers, requests_per_second=requests_per_second, burst=burst,
+            throttle=throttle, cache=cache)
+    keys = article_infos
+    if ledger is not None:
+        ledger.sync(article_infos, articles)
+        keys = ledger.outstanding(retry_failed_only)
+        logger.info("{} articles outstanding in the job ledger".format(len(keys)))
+        unknown = sum(1 for key in keys if key not in article_infos)
+        if unknown:
+            logger.warning("Skipping {} outstanding articles of the job ledger which are not in the "
+                "article list".format(unknown))
+            keys = [key for key in keys if key in article_infos]
+    pending_urls = [article_infos[key]['url'] for key in keys if key not in articles]
+    responses = iter_responses(fetcher, pending_urls, workers=workers)
+    unsaved_keys = []
     i = 0
-    _max = len(article_infos)
+    _max = len(keys)
     articles_skipped = 0
     summary_skipped = 0
     logger.info("Started scraping content for articles")
     # Initial call to print 0% progress
     print_progress_bar(0, _max, prefix = 'Progress:', suffix = 'Complete', length = 100)
 
-    for key in article_infos:
+    for key in keys:
         i += 1
         logger.debug("{} articles either processed or skipped".format(i))
         # After every 100 article_infos are processed, dump the contents into json and update progress bar
         if i%500 == 0:
             print_progress_bar(i, _max, prefix='Progress:', suffix='Complete', length=100)
-            write_articles_to_file(articles, outfile_path)
+            write_articles_to_file(articles, outfile_path, unsaved_keys)
+            unsaved_keys = []
+            if ledger is not None:
+                ledger.commit()
             logger.info("Total Processed articles = {}, Skipped Articles = {} Skipped Summaries = {}".format(
                 i, articles_skipped, summary_skipped
             ))
         if key not in articles:
             value = article_infos[key]
             url = value['url']
-            author = value['author']
-            response = requests.get(url, timeout=15)
+            response = next(responses)
             try:
-                soup = BeautifulSoup(response.content, "html.parser")
-                header_div = soup.find('div', attrs={"class":"c-entry-hero c-entry-hero--default"})
-                # title = soup.find('h1', attrs={"class":"c-page-title"}).text
-                summary = ""
-                try:
-                    summary = header_div.find('h2', attrs={"class":"c-entry-summary"}).text
-                except BaseException:
+                if isinstance(response, ArticleSkipped):
+                    raise response
+                with metrics.timer('extract'):
+                    extracted = extract_article(response.content, backend)
+                if extracted['summary'] is None:
                     summary_skipped += 1
-                if author=="unknown":
-                    author = header_div.find('span', attrs={"class":"c-byline__author-name"}).text
-                body = soup.find('div', attrs={"class":"c-entry-content"}).text
-                articles = add_article(articles, key, value['date'], value['title'], url, author, body, summary)
-            except BaseException:
+                    metrics.inc('summaries_skipped')
+                author, body, summary = article_fields(value, response.status_code, extracted)
+                articles = add_article(articles, key, value['date'], value['title'], url, author, body, summary or "")
+                unsaved_keys.append(key)
+                metrics.inc('articles_scraped')
+                if ledger is not None:
+                    ledger.mark_done(key)
+            except BaseException as error:
                 articles_skipped += 1
+                reason = getattr(error, 'reason', 'error')
+                metrics.inc('articles_skipped', reason=reason)
+                # articles missing from an offline cache were not attempted, they stay pending
+                if ledger is not None and reason != "cache_miss":
+                    ledger.mark_failed(key, reason)
+        elif ledger is not None:
+            ledger.mark_done(key)
 
+    responses.close()
     logger.info("Total articles skipped {}".format(articles_skipped))
     logger.info("Total summaries skipped {}".format(summary_skipped))
 
-    logger.info("Dumping final {} articles into json file {}".format(len(articles), outfile_path))
-    write_articles_to_file(articles, outfile_path)
+    logger.info("Dumping final {} articles into {}".format(len(articles), outfile_path))
+    write_articles_to_file(articles, outfile_path, unsaved_keys)
+    if ledger is not None:
+        ledger.commit()
+        logger.info("Job ledger: {}, failures: {}".format(ledger.counts(), ledger.failures()))
 
 
 if __name__=="__main__":
+    setup_logging()
     infos_fname = "scrapped_data/bb/bb_article_list.json"
+    # a path not ending in .json is used as an append only article store directory
+    # ArticleStore(dir).import_json(old_json_path) migrates an existing json file
     fname = "scrapped_data/bb/bb_articles.json"
-    article_infos = get_existing_articles_list(infos_fname)
-    articles = get_existing_articles(fname)
-    scrap_content(article_infos, articles, outfile_path=fname)
+    # the article infos are only read here, so they are kept in the compact columnar table
+    article_infos = get_existing_article_info_table(infos_fname)
+    articles = get_existing_articles(fname, load_bodies=not is_article_store(fname))
+    # remembers which articles are done or failed, so a resume only goes through the outstanding ones
+    # set retry_failed_only=True to only retry the failed articles
+    ledger = JobLedger("scrapped_data/bb/bb_jobs.sqlite")
+    # timeouts and 5xx answers are retried 3 times with exponential backoff before the article counts as failed
+    fetcher = Fetcher(workers=8, requests_per_second=4, retries=3)
+    # metrics are written every 10s, pass a path to profiled() to also run under cProfile
+    with MetricsExporter(["scrapped_data/bb/metrics.json", "scrapped_data/bb/metrics.prom"]), profiled(None):
+        scrap_content(article_infos, articles, outfile_path=fname,
+            workers=8, fetcher=fetcher, ledger=ledger, retry_failed_only=False)
+    ledger.close()
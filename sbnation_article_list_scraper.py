@@ -1,60 +1,29 @@
-from bs4 import BeautifulSoup
 import json
-import hashlib
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import time
-from collections import defaultdict
 from datetime import datetime
 import os.path 
 import re
 import logging
-import logging.handlers
+from sbnation_logging import setup_logging
 from pprint import pformat
-
-# create logger with 'this modules name'
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-# create file handler which logs even debug messages
-fh = logging.handlers.RotatingFileHandler(__name__+'.log', 
-    mode='w', maxBytes=1e7, backupCount=4)
-fh.setLevel(logging.DEBUG)
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-
-# create a detailed and simple formatter and add it to the handlers
-detailed_formatter = logging.Formatter(fmt=
-    ("%(asctime)-22s - %(name)-4s - %(levelname)-4s - "
-    "%(filename)-5s - %(lineno)-2s - "
-    "%(funcName)-5s \n%(message)s")
+from sbnation_http import AdaptiveThrottle
+from sbnation_metrics import MetricsExporter, metrics
+from sbnation_dedupe import ArticleKeySet, article_key, has_legacy_keys, migrate_keys
+from sbnation_article_table import ArticleInfoTable, count_by_month_and_author
+from sbnation_html_extraction import (
+    ARCHIVE_ENTRIES_SCRIPT, ARCHIVE_PARSE_ONLY, archive_entries_from_soup, extract_archive_entries, parse_html
 )
-simple_formatter = logging.Formatter('%(name)s: %(levelname)s: %(message)s')
 
-fh.setFormatter(detailed_formatter)
-ch.setFormatter(simple_formatter)
-# add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
-
-# root logger - when used as logging.info() for example instead of logger.info()
-# logging.basicConfig(level=logging.DEBUG, handlers=[fh, ch])
+logger = logging.getLogger(__name__)
 
 def print_article_list_summary_details(dic):
     """
     Log some summary details for the dictionary containing article list/information
     """
-    mm_datetime_format = "%Y-%m-%dT%H:%M:%S+00:00"
-    yearmonth_format = "%Y%m"
-    author_counts = defaultdict(int)
-    month_counts = defaultdict(int)
-    for value in dic.values():
-        _datetime = datetime.strptime(value['date'], mm_datetime_format)
-        month_counts[_datetime.strftime(yearmonth_format)] += 1
-        author_counts[value['author']] += 1
+    if isinstance(dic, ArticleInfoTable):
+        month_counts, author_counts = dic.counts()
+    else:
+        month_counts, author_counts = count_by_month_and_author(
+            [value['date'] for value in dic.values()], [value['author'] for value in dic.values()])
 
     logger.debug("Author article_info counts")
     logger.debug(pformat(author_counts, indent=2, compact=True))
@@ -70,6 +39,13 @@ def get_existing_articles_list(fname):
         article_infos = {}
         with open(fname, 'r') as article_list_file:
             article_infos = json.load(article_list_file)
+        if not article_infos:
+            # e.g. written by a crawl which did not find any entries
+            logger.info("Article list {} is empty".format(fname))
+            return {}
+        if has_legacy_keys(article_infos):
+            logger.info("Article infos in {} use the old hash keys, rekeying them by url".format(fname))
+            article_infos = migrate_keys(article_infos)
         logger.info("Total Current number of article infos = {}".format(len(article_infos)))
         _first_key = list(article_infos.keys())[0]
         logger.debug("First entry : {}".format(article_infos[_first_key]))
@@ -80,7 +56,60 @@ def get_existing_articles_list(fname):
         return {}
 
 
+def get_existing_article_info_table(fname):
+    """
+    Same as get_existing_articles_list, but loads the article infos into a compact read only
+    ArticleInfoTable, for the stages which do not add entries (e.g. scrap_content)
+    """
+    if not os.path.isfile(fname):
+        logger.info("Couldnt find any existing article infos")
+        return ArticleInfoTable.from_items(())
+    try:
+        article_infos = ArticleInfoTable.from_json(fname)
+    except ValueError:
+        # old hash keys, load and rekey the dictionary first
+        return ArticleInfoTable.from_dict(get_existing_articles_list(fname))
+    logger.info("Total Current number of article infos = {}".format(len(article_infos)))
+    print_article_list_summary_details(article_infos)
+    return article_infos
+
+
+def newest_known_month(article_infos):
+    """
+    Returns (year, month) of the newest article in article_infos, None if it is empty
+    """
+    if not article_infos:
+        return None
+    if isinstance(article_infos, ArticleInfoTable):
+        return article_infos.newest_month()
+    # dates are all "%Y-%m-%dT%H:%M:%S+00:00", so the newest is also the largest string
+    newest = max(value['date'] for value in article_infos.values())
+    return int(newest[0:4]), int(newest[5:7])
+
+
+def months_to_crawl(months, years, since=None):
+    """
+    Returns the (year, month) combinations of years and months, only those at or after since if given
+    """
+    return [(year, month) for year in years for month in months if since is None or (year, month) >= since]
+
+
+def all_known(links, known):
+    """
+    True if there are links and the articles of all of them are in known (anything supporting `in` on keys)
+    """
+    if isinstance(known, ArticleInfoTable):
+        return bool(links) and bool(known.contains_many([article_key(link) for link in links]).all())
+    return bool(links) and all(article_key(link) in known for link in links)
+
+
+# selenium is only imported by the functions driving the browser, so that the article list
+# helpers of this module can be used without paying for the selenium import
 def initialize_webdriver_for_sb(webdriver_executable_path, archives_root_url):
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     # Define Chrome options to open the window in maximized mode
     options = webdriver.ChromeOptions()
     options.add_argument("--start-maximized")
@@ -99,20 +128,39 @@ def initialize_webdriver_for_sb(webdriver_executable_path, archives_root_url):
     return driver
 
 
-def get_fully_loaded_html_page(month, year, driver, archives_root_url, 
-    tries_after_which_to_refresh=3, number_of_failures_after_which_to_skip=7):
+def load_archive_month(month, year, driver, archives_root_url,
+    tries_after_which_to_refresh=3, number_of_failures_after_which_to_skip=7, throttle=None,
+    on_entries=None):
     """
-    Returns bs4 object of the fully loaded html archive page with all the article links for
-    that particular month
+    Opens the archive page of a month and clicks its load more button until every entry is loaded.
+    If given, on_entries is called with the (title, url, author, date) entries loaded by the page load
+    and after every click (read from the page with ARCHIVE_ENTRIES_SCRIPT), and loading stops early
+    when it returns True. Returns the number of entries on the page
     :param: tries_after_which_to_refresh : number of times of unsuccessful 
     tries after which to refresh the webpage
+    :param: throttle : AdaptiveThrottle pacing the page loads and load more clicks
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    if throttle is None:
+        throttle = AdaptiveThrottle()
     # go to correct url
-    time.sleep(2)
+    throttle.wait()
     url = archives_root_url + str(year) + "/" + str(month)
-    driver.get(url)
-    wait = WebDriverWait(driver, 2)
+    with metrics.timer('page_load'):
+        driver.get(url)
+    wait = WebDriverWait(driver, max(2, throttle.delay))
     fails = 0
+    entries_seen = 0
+
+    def harvest():
+        # only the entries appended since the last call cross over from the browser
+        with metrics.timer('harvest'):
+            entries = [tuple(entry) for entry in driver.execute_script(ARCHIVE_ENTRIES_SCRIPT, entries_seen)]
+        metrics.inc('archive_entries_harvested', len(entries))
+        return entries, on_entries is not None and on_entries(entries)
+
     # click load more button as many times as possible 
     # (note that sometimes website just doesnt work which is why the code allows for retries)
     # The sbnation website themselves have limits and sometimes starts returning black pages and saying 'go slow on archives'
@@ -122,12 +170,23 @@ def get_fully_loaded_html_page(month, year, driver, archives_root_url,
     while True:
         if len(driver.find_elements_by_class_name('c-archives-load-more__button')) == 1 and time_to_refresh > 0:
             try:
-                time.sleep(2)
-                wait.until(EC.element_to_be_clickable((By.CLASS_NAME, 'c-archives-load-more__button')))
-                driver.execute_script("document.getElementsByClassName('c-archives-load-more__button')[0].click()")
+                throttle.wait()
+                entries, stop = harvest()
+                entries_seen += len(entries)
+                if stop:
+                    logger.debug("Stopped loading more for {}-{}".format(year, month))
+                    metrics.inc('archive_early_stops')
+                    return entries_seen
+                with metrics.timer('load_more_click'):
+                    wait.until(EC.element_to_be_clickable((By.CLASS_NAME, 'c-archives-load-more__button')))
+                    driver.execute_script("document.getElementsByClassName('c-archives-load-more__button')[0].click()")
+                metrics.inc('load_more_clicks', outcome='ok')
+                throttle.record_success()
             except BaseException:
+                metrics.inc('load_more_clicks', outcome='failed')
+                throttle.record_block(url, "load more button not clickable")
                 if fails >= number_of_failures_after_which_to_skip:
-                    logger.debug("Reached too many failures for {}-{}, time to parse data".format(year, month))
+                    logger.debug("Reached too many failures for {}-{}, done loading".format(year, month))
                     time_to_refresh = 3
                     break
                 logger.debug("waited too long for load more button")
@@ -136,60 +195,146 @@ def get_fully_loaded_html_page(month, year, driver, archives_root_url,
         elif time_to_refresh == 0:
             logger.debug("refreshing the page")
             fails += 1
-            driver.refresh()
+            metrics.inc('page_refreshes')
+            throttle.wait()
+            with metrics.timer('page_load'):
+                driver.refresh()
+            # the refreshed page starts over with the first entries
+            entries_seen = 0
             time_to_refresh = 3
         else:
-            logger.debug("Done clicking load more for {}-{}, time to parse data".format(year, month))
+            logger.debug("Done clicking load more for {}-{}".format(year, month))
             time_to_refresh = 3
             break
 
+    entries, _ = harvest()
+    entries_seen += len(entries)
+    # the website returns blank pages when it wants us to 'go slow on archives'
+    if entries_seen == 0:
+        throttle.record_block(url, "empty archive page")
+    return entries_seen
+
+
+def get_fully_loaded_html_page(month, year, driver, archives_root_url, 
+    tries_after_which_to_refresh=3, number_of_failures_after_which_to_skip=7, throttle=None,
+    backend="html.parser", known=None):
+    """
+    Returns bs4 object of the fully loaded html archive page with all the article links for
+    that particular month
+    :param: tries_after_which_to_refresh : number of times of unsuccessful 
+    tries after which to refresh the webpage
+    :param: throttle : AdaptiveThrottle pacing the page loads and load more clicks
+    :param: backend : parser backend used to build the bs4 object ('html.parser' or 'lxml'),
+    only the archive entries are parsed
+    :param: known : optional keys of the articles already known (e.g. the existing article infos).
+    The archives list the newest articles first, so loading more stops as soon as all the entries
+    loaded by the last click are known
+    """
+    on_entries = None
+    if known is not None:
+        on_entries = lambda entries: all_known([entry[1] for entry in entries], known)
+    load_archive_month(month, year, driver, archives_root_url, tries_after_which_to_refresh,
+        number_of_failures_after_which_to_skip, throttle, on_entries)
+
     # response = requests.get(root_url, timeout=5)
-    bs4_content = BeautifulSoup(driver.page_source, "html.parser")
+    page_source = driver.page_source
+    metrics.inc('page_source_bytes', len(page_source))
+    with metrics.timer('parse', page='archive'):
+        bs4_content = parse_html(page_source, backend, parse_only=ARCHIVE_PARSE_ONLY)
     #logger.debug("Printing HTML content found for {}-{}".format(year, month))
     #logger.debug(bs4_content.prettify())
     return bs4_content
 
 
-def add_to_dictionary(existing_article_infos, _date, title, author, address):
-    _hash = int(hashlib.sha1((_date+title+author).encode('utf-8')).hexdigest(), 16) % (10 ** 8)
-    if _hash not in existing_article_infos:
+def harvest_archive_month(month, year, driver, archives_root_url, existing_article_infos,
+    throttle=None, incremental=False, known_keys=None):
+    """
+    Loads the archive page of a month like get_fully_loaded_html_page, but adds the entries to
+    existing_article_infos as they are loaded instead of parsing the whole page at the end.
+    Only the compact entry tuples of every click cross over from the browser, so memory and parse
+    time stay bounded for busy months, and the entries found before a failure are kept
+    :param: incremental : stop loading more once a click only loads articles known before the run
+    :param: known_keys : optional ArticleKeySet of the keys in existing_article_infos before the run,
+    see add_to_dictionary. Taken here if not given
+    """
+    if known_keys is None:
+        known_keys = ArticleKeySet(existing_article_infos)
+
+    def on_entries(entries):
+        # decided against the keys from before the run: after a refresh the first entries of the month
+        # are harvested again, and they are in existing_article_infos already
+        stop = incremental and all_known([entry[1] for entry in entries], known_keys)
+        add_entries_to_dictionary(entries, existing_article_infos, known_keys=known_keys)
+        return stop
+
+    load_archive_month(month, year, driver, archives_root_url, throttle=throttle, on_entries=on_entries)
+    return existing_article_infos
+
+
+def add_to_dictionary(existing_article_infos, _date, title, author, address, known_keys=None):
+    """
+    Adds an article entry keyed by article_key(address) unless it is already known
+    :param: known_keys : optional sbnation_dedupe.ArticleKeySet of keys which are already stored
+    (the scrapers pass the keys the article list had when the run started), entries found in it
+    are not added. Its bloom filter answers the lookups of new articles without touching the dictionary
+    """
+    _hash = article_key(address)
+    if known_keys is not None and _hash in known_keys:
+        metrics.inc('archive_entries', outcome='known')
+        logger.debug("Article already known")
+    elif _hash not in existing_article_infos:
         existing_article_infos[_hash] = {"date": _date, "title": title, "url": address, "author": author}
+        metrics.inc('archive_entries', outcome='added')
         logger.debug("Added article to dictionary")
     else:
+        metrics.inc('archive_entries', outcome='duplicate')
         logger.debug("Article already exists in dictionary")
         # print("Hash already exists")
     return existing_article_infos
 
 
-def extract_links_from_html(bs4_content, existing_article_infos,
-        regex_compiled_pattern = re.compile(
-            r'\/(?P<year>\d{4})\/(?P<month>\d{1,2})\/(?P<day>\d{1,2})\/'
-        )
+ARTICLE_DATE_PATTERN = re.compile(
+    r'\/(?P<year>\d{4})\/(?P<month>\d{1,2})\/(?P<day>\d{1,2})\/'
+)
+
+
+def extract_links_from_html(content, existing_article_infos,
+        regex_compiled_pattern = ARTICLE_DATE_PATTERN, backend="html.parser", known_keys=None
     ):
+    """
+    Adds the article entries of an archive page to existing_article_infos
+    :param: content : bs4 object or raw html of the archive page
+    :param: backend : parser backend used when content is raw html (see sbnation_html_extraction)
+    :param: known_keys : optional ArticleKeySet of keys which should not be added again
+    """
     # Load all content into the dictionary by scouring through the html content
     logger.debug("Parsing HTML for extracting article entries")
-    for entry in bs4_content.findAll('div', attrs={"class":"c-entry-box--compact__body"}):
-        h2 = entry.find('h2', attrs={"class": 'c-entry-box--compact__title'})
-        a = h2.find('a')
-        title = a.text
-        address = a['href']
-        byline_div = entry.find('div', attrs={"class":"c-byline"})
+    if isinstance(content, (str, bytes)):
+        entries = extract_archive_entries(content, backend)
+    else:
+        entries = archive_entries_from_soup(content)
+    return add_entries_to_dictionary(entries, existing_article_infos, regex_compiled_pattern, known_keys)
+
+
+def add_entries_to_dictionary(entries, existing_article_infos,
+        regex_compiled_pattern = ARTICLE_DATE_PATTERN, known_keys=None
+    ):
+    """
+    Adds (title, url, author, date) archive entries to existing_article_infos
+    """
+    for title, address, author, _date in entries:
         logger.debug("found an article entry with title : {}".format(title))
 
         # Earlier this used to exist, but not as of October 2019
         # so now it will usually go into else
         # where no author information available
         # and lesser dateinformation available as well
-        if byline_div is not None:
-            spans = byline_div.findAll('span', attrs={"class":"c-byline__item"})
-            if len(spans) == 2:
-                logger.debug("Found detailed author and date information")
-                author = spans[0].find('a').text
-                _date = spans[1].find('time')['datetime']
-                existing_article_infos = add_to_dictionary(
-                    existing_article_infos, _date, title, author, address
-                )
-                continue
+        if author is not None:
+            logger.debug("Found detailed author and date information")
+            existing_article_infos = add_to_dictionary(
+                existing_article_infos, _date, title, author, address, known_keys
+            )
+            continue
         
         logger.debug("Couldnt find detailed author and date information, storing whatever found")
         _date_match_obj = regex_compiled_pattern.search(address)
@@ -201,7 +346,7 @@ def extract_links_from_html(bs4_content, existing_article_infos,
         mm_datetime_format = "%Y-%m-%dT%H:%M:%S+00:00"
         _datetime_string = _datetime.strftime(mm_datetime_format)
         existing_article_infos = add_to_dictionary(
-            existing_article_infos, _datetime_string, title, 'unknown', address
+            existing_article_infos, _datetime_string, title, 'unknown', address, known_keys
         )
         
     return existing_article_infos
@@ -209,24 +354,40 @@ def extract_links_from_html(bs4_content, existing_article_infos,
 
 def scrape_from_sbnation(months, years, 
     outfile_path, existing_article_infos,
-    webdriver_executable_path, archives_root_url):
+    webdriver_executable_path, archives_root_url, throttle=None, incremental=False):
     """
     Scrapes from Sports Nation Website using a selenium chromedriver
+    :param: throttle : AdaptiveThrottle deciding how long to wait between page loads and clicks,
+    speeds up while the website responds and backs off when it returns blank pages
+    :param: incremental : only pick up the articles published since the last run, i.e. skip the months
+    before the newest month in existing_article_infos and stop loading more of a month once only
+    already known articles show up
     """
+    from selenium.common.exceptions import WebDriverException
+    if throttle is None:
+        throttle = AdaptiveThrottle()
     driver = initialize_webdriver_for_sb(
         webdriver_executable_path = webdriver_executable_path,
         archives_root_url = archives_root_url
     )
 
+    since = newest_known_month(existing_article_infos) if incremental else None
+    if since is not None:
+        logger.info("Incremental refresh, crawling the months since {}-{}".format(*since))
+    known_keys = ArticleKeySet(existing_article_infos)
     # Loop through all the years and months combinations
-    for year in years:
-        time.sleep(5)
-        for month in months:
-            content = get_fully_loaded_html_page(month, year, driver, archives_root_url)
-            existing_article_infos = extract_links_from_html(content, existing_article_infos)
-            logger.info("Processed articles for (year-month = {}-{}) No. of articles now = {}"
-                .format(year, month, len(existing_article_infos)))
+    for year, month in months_to_crawl(months, years, since):
+        try:
+            existing_article_infos = harvest_archive_month(month, year, driver, archives_root_url,
+                existing_article_infos, throttle=throttle, incremental=incremental, known_keys=known_keys)
+        except WebDriverException as error:
+            # the entries harvested before the failure are already in existing_article_infos
+            logger.warning("Failed loading {}-{}, moving on: {}".format(year, month, error))
+            metrics.inc('archive_months_failed')
+        logger.info("Processed articles for (year-month = {}-{}) No. of articles now = {}"
+            .format(year, month, len(existing_article_infos)))
     logger.info("Done processing articles")
+    logger.info("Final request rate {:.2f}/s, {} block events".format(throttle.rate, len(throttle.block_events)))
     driver.quit()
 
     logger.info("Writing json to {} file".format(outfile_path))
@@ -238,16 +399,20 @@ Change these parameters to scrape article links list you are interested in
 Requires selenium chrome webdriver
 """
 if __name__ == '__main__':
+    setup_logging()
     outfile_path = "scrapped_data/bb/bb_article_list.json"
     archives_root_url = "https://www.barcablaugranes.com/archives/"
     webdriver_executable_path = "/Users/ankurs4/Downloads/chromedriver"
     article_infos = get_existing_articles_list(fname=outfile_path)
     months = range(1, 10, 1)
     years = range(2019, 2020, 1)
-    scrape_from_sbnation(
-        months, years, 
-        existing_article_infos = article_infos,
-        outfile_path = outfile_path,
-        webdriver_executable_path = webdriver_executable_path,
-        archives_root_url = archives_root_url
-    )
\ No newline at end of file
+    with MetricsExporter(["scrapped_data/bb/list_metrics.json", "scrapped_data/bb/list_metrics.prom"]):
+        scrape_from_sbnation(
+            months, years, 
+            existing_article_infos = article_infos,
+            outfile_path = outfile_path,
+            webdriver_executable_path = webdriver_executable_path,
+            archives_root_url = archives_root_url,
+            # set to True for a quick refresh which only picks up the articles published since the last run
+            incremental = False
+        )
\ No newline at end of file
@@ -0,0 +1,480 @@
+import json
+import os
+import os.path
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+
+
+def dump_json(obj, path):
+    """
+    Writes obj as json to path. The json is written to a temporary file first and moved into place,
+    so a crash or Ctrl-C in the middle of a checkpoint leaves the previous file intact
+    """
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump(obj, outfile)
+    os.replace(path + '.tmp', path)
+
+
+def iter_json_object_items(fname, chunk_size=1 << 20, with_offsets=False):
+    """
+    Yields (key, value) pairs of the top level object in a json file one at a time,
+    without ever holding more than one value (and one chunk of the file) in memory
+    :param: with_offsets : yield (key, value, byte offset, byte length) instead, where offset
+    and length locate the raw json of the value in the file
+    """
+    with open(fname, 'r', encoding='utf-8', newline='') as infile:
+        # mark_char is a position in buf whose absolute byte offset in the file is mark_byte
+        state = {"buf": "", "pos": 0, "eof": False, "mark_char": 0, "mark_byte": 0}
+
+        def byte_offset(pos):
+            state["mark_byte"] += len(state["buf"][state["mark_char"]:pos].encode('utf-8'))
+            state["mark_char"] = pos
+            return state["mark_byte"]
+
+        def read_more():
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                state["eof"] = True
+                return
+            if state["pos"] > len(state["buf"]) // 2:
+                if with_offsets:
+                    byte_offset(state["pos"])
+                    state["mark_char"] = 0
+                state["buf"] = state["buf"][state["pos"]:]
+                state["pos"] = 0
+            state["buf"] += chunk
+
+        def skip_whitespace():
+            while True:
+                state["pos"] = _WHITESPACE.match(state["buf"], state["pos"]).end()
+                if state["pos"] < len(state["buf"]) or state["eof"]:
+                    return
+                read_more()
+
+        def next_char():
+            skip_whitespace()
+            if state["pos"] >= len(state["buf"]):
+                raise ValueError("Unexpected end of json file {}".format(fname))
+            char = state["buf"][state["pos"]]
+            state["pos"] += 1
+            return char
+
+        def decode_value():
+            skip_whitespace()
+            while True:
+                try:
+                    start = state["pos"]
+                    value, end = _DECODER.raw_decode(state["buf"], start)
+                    # a value ending exactly at the end of the buffer may have been cut short
+                    if end < len(state["buf"]) or state["eof"]:
+                        state["pos"] = end
+                        if with_offsets:
+                            offset = byte_offset(start)
+                            return value, offset, byte_offset(end) - offset
+                        return value
+                except json.JSONDecodeError:
+                    if state["eof"]:
+                        raise
+                read_more()
+
+        if next_char() != '{':
+            raise ValueError("{} does not contain a json object".format(fname))
+        skip_whitespace()
+        if state["buf"][state["pos"]:state["pos"] + 1] == '}':
+            return
+        while True:
+            key = decode_value()
+            if next_char() != ':':
+                raise ValueError("Malformed json object in {}".format(fname))
+            if with_offsets:
+                key = key[0]
+                value, offset, length = decode_value()
+                yield key, value, offset, length
+            else:
+                yield key, decode_value()
+            separator = next_char()
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError("Malformed json object in {}".format(fname))
+
+
+def iter_articles(fname):
+    """
+    Yields (key, article) pairs from either a json file or an article store directory,
+    one article at a time
+    """
+    if os.path.isdir(fname):
+        return ArticleStore(fname).iter_latest_items()
+    return iter_json_object_items(fname)
+
+
+def _index_entry(key, article, location, offset, length):
+    """
+    The metadata kept in an index for one article, location is the file the article is stored in
+    and offset/length are the byte range of its json in that file
+    """
+    return {"key": key, "date": article.get('date'), "author": article.get('author'),
+        "url": article.get('url'), "title": article.get('title'),
+        "location": location, "offset": offset, "length": length}
+
+
+class ArticleIndex(object):
+    """
+    Dictionary like view of the articles in a json file or article store which only keeps
+    key, date, author, url and title of every article in memory. Indexing (or values())
+    returns this metadata, the full article is read from disk by load_article.
+    Articles assigned to the index (scrap_content does this for new articles) are kept in memory
+    in full until they are committed to the store (see mark_stored), so the index can be passed
+    to scrap_content instead of the articles dictionary
+    """
+    metadata_fields = ("date", "title", "url", "author")
+
+    def __init__(self, entries, read_article):
+        self._entries = entries
+        self._read_article = read_article
+        self._added = {}
+
+    def __len__(self):
+        return len(self._entries) + sum(1 for key in self._added if key not in self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._added
+
+    def __iter__(self):
+        for key in self._entries:
+            yield key
+        for key in self._added:
+            if key not in self._entries:
+                yield key
+
+    def keys(self):
+        return iter(self)
+
+    def __getitem__(self, key):
+        if key in self._added:
+            return self._added[key]
+        entry = self._entries[key]
+        return dict((field, entry[field]) for field in self.metadata_fields)
+
+    def __setitem__(self, key, article):
+        self._added[key] = article
+
+    def values(self):
+        for key in self:
+            yield self[key]
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+    def load_article(self, key):
+        """
+        Returns the full article (including the content) for key
+        """
+        if key in self._added:
+            return self._added[key]
+        return self._read_article(self._entries[key])
+
+    def mark_stored(self, entries):
+        """
+        Replaces the assigned articles by the index entries ArticleStore.commit returned for them,
+        so only the articles which are not checkpointed yet are kept in memory in full
+        """
+        for entry in entries:
+            self._entries[entry['key']] = entry
+            self._added.pop(entry['key'], None)
+
+
+def _read_range(path, offset, length):
+    with open(path, 'rb') as infile:
+        infile.seek(offset)
+        return infile.read(length)
+
+
+def _json_index_path(fname):
+    return fname + '.index.jsonl'
+
+
+def open_json_file_index(fname):
+    """
+    Returns an ArticleIndex for a json articles file. The index is kept in a sidecar
+    <fname>.index.jsonl file and rebuilt (in one streaming pass) whenever the json file changes
+    """
+    index_path = _json_index_path(fname)
+    stat = os.stat(fname)
+    source = {"size": stat.st_size, "mtime": stat.st_mtime}
+    entries = None
+    if os.path.isfile(index_path):
+        with open(index_path, 'r', encoding='utf-8') as index_file:
+            header = json.loads(index_file.readline() or 'null')
+            if header == source:
+                entries = {}
+                for line in index_file:
+                    entry = json.loads(line)
+                    entries[entry['key']] = entry
+    if entries is None:
+        logger.info("Building index of {}".format(fname))
+        entries = {}
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as index_file:
+            index_file.write(json.dumps(source) + "\n")
+            for key, article, offset, length in iter_json_object_items(fname, with_offsets=True):
+                entry = _index_entry(key, article, None, offset, length)
+                entries[key] = entry
+                index_file.write(json.dumps(entry) + "\n")
+        os.replace(index_path + '.tmp', index_path)
+
+    def read_article(entry):
+        return json.loads(_read_range(fname, entry['offset'], entry['length']))
+    return ArticleIndex(entries, read_article)
+
+
+def open_article_index(fname):
+    """
+    Returns an ArticleIndex for a json file or an article store directory
+    """
+    if os.path.isdir(fname):
+        return ArticleStore(fname).index()
+    return open_json_file_index(fname)
+
+
+def is_article_store(path):
+    """
+    Paths ending in .json are plain json dumps, anything else is an article store directory
+    """
+    return os.path.isdir(path) or not path.endswith('.json')
+
+
+class ArticleStore(object):
+    """
+    Append only article store, made of a directory of jsonl segment files.
+    Every line is one {"key": key, "value": article} record, a later record for the same key
+    replaces an earlier one. New records are buffered by append() and only written to disk
+    (and fsync'd) by commit(), so a checkpoint only costs as much as the new articles
+    :param: max_segment_bytes : size after which a new segment file is started
+    """
+    segment_prefix = 'articles-'
+    segment_suffix = '.jsonl'
+    index_name = 'index.jsonl'
+
+    def __init__(self, directory, max_segment_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self._pending = []
+
+    def segment_paths(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(self.segment_prefix) and name.endswith(self.segment_suffix)
+        )
+        return [os.path.join(self.directory, name) for name in names]
+
+    def iter_items(self):
+        """
+        Yields (key, article) for every record in the store, in the order they were written
+        """
+        for path in self.segment_paths():
+            with open(path, 'r', encoding='utf-8') as segment:
+                for line in segment:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # only the very last line of a segment can be torn by a crash
+                        logger.warning("Ignoring incomplete record at the end of {}".format(path))
+                        continue
+                    yield record['key'], record['value']
+
+    def iter_latest_items(self):
+        """
+        Like iter_items, but only yields the latest record of every key.
+        A first pass only decodes the keys, so memory stays proportional to the number of keys
+        """
+        latest = {}
+        key_start = len('{"key": ')
+        for segment_number, path in enumerate(self.segment_paths()):
+            with open(path, 'r', encoding='utf-8') as segment:
+                for line_number, line in enumerate(segment):
+                    try:
+                        key, _ = _DECODER.raw_decode(line, key_start)
+                    except ValueError:
+                        continue
+                    latest[key] = (segment_number, line_number)
+        for segment_number, path in enumerate(self.segment_paths()):
+            with open(path, 'r', encoding='utf-8') as segment:
+                for line_number, line in enumerate(segment):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if latest.get(record['key']) == (segment_number, line_number):
+                        yield record['key'], record['value']
+
+    def load(self):
+        articles = {}
+        for key, article in self.iter_items():
+            articles[key] = article
+        return articles
+
+    def append(self, key, article):
+        record = (json.dumps({"key": key, "value": article}) + "\n").encode('utf-8')
+        self._pending.append((key, article, record))
+
+    def commit(self):
+        """
+        Write all appended records to the current segment and fsync it,
+        then add them to the index. Returns the index entries of the committed records
+        """
+        if not self._pending:
+            return []
+        path = self._writable_segment_path()
+        location = os.path.basename(path)
+        entries = []
+        with open(path, 'ab') as segment:
+            offset = segment.seek(0, os.SEEK_END)
+            for key, article, record in self._pending:
+                entries.append(_index_entry(key, article, location, offset, len(record)))
+                offset += len(record)
+            segment.write(b''.join(record for _, _, record in self._pending))
+            segment.flush()
+            os.fsync(segment.fileno())
+        # the index is only written once the records it points to are safely on disk
+        with open(self.index_path, 'a', encoding='utf-8') as index_file:
+            index_file.write(''.join(json.dumps(entry) + "\n" for entry in entries))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        logger.debug("Committed {} articles to {}".format(len(self._pending), path))
+        self._pending = []
+        return entries
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, self.index_name)
+
+    def index(self):
+        """
+        Returns an ArticleIndex of the store, read from the index file.
+        The index file is rebuilt from the segments if it does not cover all of them
+        """
+        def read_article(entry):
+            record = _read_range(os.path.join(self.directory, entry['location']), entry['offset'], entry['length'])
+            return json.loads(record)['value']
+
+        entries = {}
+        covered = {}
+        if not os.path.isdir(self.directory):
+            return ArticleIndex(entries, read_article)
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as index_file:
+                for line in index_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry['key']] = entry
+                    covered[entry['location']] = max(
+                        covered.get(entry['location'], 0), entry['offset'] + entry['length'])
+        segment_sizes = dict(
+            (os.path.basename(path), os.path.getsize(path)) for path in self.segment_paths())
+        if covered != dict((name, size) for name, size in segment_sizes.items() if size > 0):
+            entries = self.rebuild_index()
+        return ArticleIndex(entries, read_article)
+
+    def rebuild_index(self):
+        """
+        Rewrite the index file by scanning all the segments, returns the index entries
+        """
+        logger.info("Rebuilding index of article store {}".format(self.directory))
+        entries = {}
+        with open(self.index_path + '.tmp', 'w', encoding='utf-8') as index_file:
+            for path in self.segment_paths():
+                location = os.path.basename(path)
+                offset = 0
+                with open(path, 'rb') as segment:
+                    for record in segment:
+                        try:
+                            parsed = json.loads(record)
+                        except ValueError:
+                            break
+                        entry = _index_entry(parsed['key'], parsed['value'], location, offset, len(record))
+                        entries[entry['key']] = entry
+                        index_file.write(json.dumps(entry) + "\n")
+                        offset += len(record)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(self.index_path + '.tmp', self.index_path)
+        return entries
+
+    def _writable_segment_path(self):
+        paths = self.segment_paths()
+        if paths:
+            self._truncate_torn_record(paths[-1])
+            if os.path.getsize(paths[-1]) < self.max_segment_bytes:
+                return paths[-1]
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "{}{:05d}{}".format(
+            self.segment_prefix, len(paths) + 1, self.segment_suffix))
+        open(path, 'a').close()
+        self._fsync_directory()
+        return path
+
+    def _truncate_torn_record(self, path):
+        with open(path, 'rb+') as segment:
+            size = segment.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            segment.seek(size - 1)
+            if segment.read(1) == b'\n':
+                return
+            # walk back to the end of the last complete record
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                segment.seek(start)
+                block = segment.read(end - start)
+                newline = block.rfind(b'\n')
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            logger.warning("Truncating incomplete record at the end of {}".format(path))
+            segment.truncate(end)
+
+    def _fsync_directory(self):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def import_json(self, json_path):
+        """
+        Append every article of a json file in the old single dump format to the store
+        """
+        count = 0
+        for key, article in iter_json_object_items(json_path):
+            self.append(key, article)
+            count += 1
+            if count % 500 == 0:
+                self.commit()
+        self.commit()
+        logger.info("Imported {} articles from {} into {}".format(count, json_path, self.directory))
+        return count
+
+    def export_json(self, json_path):
+        """
+        Write the current contents of the store as a single json dump in the old format
+        """
+        articles = self.load()
+        with open(json_path, 'w') as outfile:
+            json.dump(articles, outfile)
+        logger.info("Exported {} articles from {} to {}".format(len(articles), self.directory, json_path))
+        return len(articles)
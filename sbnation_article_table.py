@@ -0,0 +1,244 @@
+"""
+Compact columnar representation of an article infos dictionary (article_key(url) : date, title, url, author).
+
+A dictionary of dictionaries costs several hundred bytes per entry, an ArticleInfoTable keeps
+    keys     uint64 array (article keys are 64 bit hashes, see sbnation_dedupe)
+    epochs   int64 seconds, the dates are all in the "%Y-%m-%dT%H:%M:%S+00:00" format
+    months   int32 months since 1970-01, for counting and filtering by month
+    authors  int32 codes into a list of the distinct (interned) author names
+    titles, urls  utf-8 string tables
+so that summaries, filtering and key lookups are numpy array operations instead of python loops.
+"""
+from collections import defaultdict
+from collections.abc import Mapping
+import logging
+
+import numpy as np
+
+from sbnation_article_store import iter_json_object_items
+from sbnation_dedupe import is_article_key
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT_SUFFIX = "+00:00"
+
+
+def parse_dates(dates):
+    """
+    Returns the epoch seconds of "%Y-%m-%dT%H:%M:%S+00:00" dates, parsed by numpy in one go
+    """
+    # the U19 cast drops the "+00:00" which numpy does not accept
+    return np.array(dates, dtype='U19').astype('datetime64[s]').astype(np.int64)
+
+
+def months_of(epochs):
+    """
+    Returns the months since 1970-01 of epoch seconds
+    """
+    return epochs.astype('datetime64[s]').astype('datetime64[M]').astype(np.int32)
+
+
+def month_label(month):
+    """
+    "%Y%m" label of a month since 1970-01, as used by the summaries
+    """
+    return "{:04d}{:02d}".format(1970 + int(month) // 12, int(month) % 12 + 1)
+
+
+def intern_strings(strings):
+    """
+    Returns (list of the distinct strings, int32 array of the index of every string in that list)
+    """
+    codes_by_string = {}
+    codes = np.fromiter((codes_by_string.setdefault(string, len(codes_by_string)) for string in strings),
+        dtype=np.int32)
+    return list(codes_by_string), codes
+
+
+def count_by_month_and_author(dates, authors):
+    """
+    Returns (month "%Y%m" : count, author : count) dictionaries for parallel lists of dates and authors
+    """
+    return _counts(months_of(parse_dates(dates)), *intern_strings(authors))
+
+
+def _counts(months, author_names, author_codes):
+    month_counts = defaultdict(int)
+    author_counts = defaultdict(int)
+    if len(months):
+        first = int(months.min())
+        for offset, count in enumerate(np.bincount(months - first)):
+            if count:
+                month_counts[month_label(first + offset)] = int(count)
+        for code, count in enumerate(np.bincount(author_codes, minlength=len(author_names))):
+            author_counts[author_names[code]] = int(count)
+    return month_counts, author_counts
+
+
+class StringTable(object):
+    """
+    Immutable list of strings stored as one utf-8 buffer and an array of offsets
+    """
+    def __init__(self, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        self._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(string) for string in encoded), dtype=np.int64, count=len(encoded)),
+            out=self._offsets[1:])
+        self._buffer = b"".join(encoded)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._buffer[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+
+    @property
+    def nbytes(self):
+        return len(self._buffer) + self._offsets.nbytes
+
+
+class ArticleInfoTable(Mapping):
+    """
+    Read only, columnar article infos. Behaves like the article infos dictionary it was built from
+    (same keys in the same order, table[key] returns the same dictionary), so it can be passed to
+    scrap_content, and adds vectorized summaries, filters and batched key lookups
+    """
+    def __init__(self, keys, dates, titles, urls, authors):
+        self.keys_array = np.fromiter((int(key, 16) for key in keys), dtype=np.uint64, count=len(keys))
+        self.epochs = parse_dates(dates)
+        self.months = months_of(self.epochs)
+        self.author_names, self.author_codes = intern_strings(authors)
+        self.titles = StringTable(titles)
+        self.urls = StringTable(urls)
+        # sorted copy of the keys for binary searches, and the row of every sorted key
+        self._order = np.argsort(self.keys_array, kind='stable')
+        self._sorted_keys = self.keys_array[self._order]
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Builds a table from (key, article info) pairs, e.g. dic.items().
+        Raises ValueError for keys which are not article keys (see sbnation_dedupe.migrate_keys)
+        """
+        keys, dates, titles, urls, authors = [], [], [], [], []
+        for key, value in items:
+            if not is_article_key(key):
+                raise ValueError("{} is not an article key".format(key))
+            keys.append(key)
+            dates.append(value['date'])
+            titles.append(value['title'])
+            urls.append(value['url'])
+            authors.append(value['author'])
+        return cls(keys, dates, titles, urls, authors)
+
+    @classmethod
+    def from_dict(cls, dic):
+        return cls.from_items(dic.items())
+
+    @classmethod
+    def from_json(cls, fname):
+        """
+        Builds a table from an article list json file, streaming it so that the whole
+        dictionary is never held in memory
+        """
+        return cls.from_items(iter_json_object_items(fname))
+
+    def __len__(self):
+        return len(self.keys_array)
+
+    def __iter__(self):
+        for value in self.keys_array:
+            yield "{:016x}".format(int(value))
+
+    def _rows(self, values):
+        rows = np.full(len(values), -1, dtype=np.int64)
+        if not len(self):
+            return rows
+        positions = np.minimum(np.searchsorted(self._sorted_keys, values), len(self) - 1)
+        found = self._sorted_keys[positions] == values
+        rows[found] = self._order[positions[found]]
+        return rows
+
+    def row_of(self, key):
+        """
+        Returns the row of key, -1 if it is not in the table
+        """
+        try:
+            value = int(key, 16)
+        except (TypeError, ValueError):
+            return -1
+        if not 0 <= value < 2 ** 64:
+            return -1
+        return int(self._rows(np.array([value], dtype=np.uint64))[0])
+
+    def __contains__(self, key):
+        return self.row_of(key) >= 0
+
+    def contains_many(self, keys):
+        """
+        Returns a boolean array telling which of keys (article key strings) are in the table,
+        with one vectorized binary search for all of them
+        """
+        values = np.fromiter((int(key, 16) for key in keys), dtype=np.uint64)
+        return self._rows(values) >= 0
+
+    def row(self, i):
+        return {"date": self.date(i), "title": self.titles[i], "url": self.urls[i],
+            "author": self.author_names[self.author_codes[i]]}
+
+    def date(self, i):
+        return str(self.epochs[i].astype('datetime64[s]')) + DATE_FORMAT_SUFFIX
+
+    def __getitem__(self, key):
+        i = self.row_of(key)
+        if i < 0:
+            raise KeyError(key)
+        return self.row(i)
+
+    def items(self):
+        # row by row instead of a binary search per key
+        for i, key in enumerate(self):
+            yield key, self.row(i)
+
+    def values(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def select(self, author=None, month=None):
+        """
+        Returns the rows written by author and/or published in month ("%Y%m", e.g. "201910")
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if author is not None:
+            code = self.author_names.index(author) if author in self.author_names else -1
+            mask &= self.author_codes == code
+        if month is not None:
+            mask &= self.months == (int(month[:4]) - 1970) * 12 + int(month[4:]) - 1
+        return np.flatnonzero(mask)
+
+    def keys_of(self, rows):
+        return ["{:016x}".format(int(value)) for value in self.keys_array[rows]]
+
+    def counts(self):
+        """
+        Returns (month "%Y%m" : count, author : count) dictionaries
+        """
+        return _counts(self.months, self.author_names, self.author_codes)
+
+    def newest_month(self):
+        """
+        Returns (year, month) of the newest article, None if the table is empty
+        """
+        if not len(self):
+            return None
+        month = int(self.months.max())
+        return 1970 + month // 12, month % 12 + 1
+
+    def to_dict(self):
+        return dict((key, self.row(i)) for i, key in enumerate(self))
+
+    @property
+    def nbytes(self):
+        return (self.keys_array.nbytes + self.epochs.nbytes + self.months.nbytes + self.author_codes.nbytes
+            + self._order.nbytes + self._sorted_keys.nbytes + self.titles.nbytes + self.urls.nbytes
+            + sum(len(name) for name in self.author_names))
@@ -0,0 +1,271 @@
+"""
+Offline benchmark of the scrape -> extract -> compile pipeline.
+
+Synthetic archive and article pages shaped like the SB Nation markup are served from a
+local http server, and the archive crawler, the content scraper and the text compiler are run
+against them. Every corpus size is run in its own process so that peak RSS is measured per size.
+
+    python3 sbnation_benchmark.py --sizes 1000 10000 100000 --output bench.json
+"""
+import argparse
+import json
+import math
+import os
+import os.path
+import platform
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENTRIES_PER_PAGE = 20
+PAGES_PER_MONTH = 25
+FIRST_YEAR = 2015
+WORDS = ("madrid barcelona goal midfield press counter attack keeper derby season coach "
+    "transfer window injury tactics league cup final fans stadium striker winger defence").split()
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def article_id_to_path(article_id):
+    month_index = article_id // (ENTRIES_PER_PAGE * PAGES_PER_MONTH)
+    year, month = FIRST_YEAR + month_index // 12, month_index % 12 + 1
+    day = article_id % 28 + 1
+    return "/{}/{}/{}/{}/synthetic-article-{}".format(year, month, day, article_id, article_id)
+
+
+def render_article_page(article_id, paragraphs=12):
+    """
+    Returns the html of a synthetic article page, with the surrounding navigation,
+    scripts and related links that make real pages expensive to parse
+    """
+    rng = random.Random(article_id)
+    navigation = "".join(
+        '<li class="c-nav-list__item"><a href="/section/{0}">Section {0}</a></li>'.format(i) for i in range(40))
+    related = "".join(
+        '<div class="c-related-list__item"><a href="{}">{}</a></div>'.format(
+            article_id_to_path(rng.randrange(10 ** 6)), _sentence(rng, 6)) for _ in range(15))
+    body = "".join("<p>{}</p>".format(" ".join(_sentence(rng) for _ in range(5))) for _ in range(paragraphs))
+    return (
+        '<!DOCTYPE html><html><head><title>Article {id}</title>'
+        '<script>window.chorus = {{"config": "{script}"}};</script></head><body>'
+        '<nav class="c-global-header"><ul class="c-nav-list">{navigation}</ul></nav>'
+        '<div class="l-wrapper"><div class="c-entry-hero c-entry-hero--default">'
+        '<h1 class="c-page-title">{title}</h1>'
+        '<h2 class="c-entry-summary p-dek">{summary}</h2>'
+        '<div class="c-byline"><span class="c-byline__item">'
+        '<span class="c-byline__author-name">Author {author}</span></span></div></div>'
+        '<div class="c-entry-content ">{body}</div>'
+        '<div class="c-related-list">{related}</div></div>'
+        '<footer class="c-footer">{footer}</footer></body></html>'
+    ).format(id=article_id, script="x" * 2000, navigation=navigation, title=_sentence(rng, 8),
+        summary=_sentence(rng), author=article_id % 25, body=body, related=related,
+        footer=_sentence(rng, 30)).encode('utf-8')
+
+
+def render_archive_page(month_index, page, total_articles, base_url=""):
+    """
+    Returns the html of archive page `page` of a month, or a page without entries past the end
+    """
+    first = (month_index * PAGES_PER_MONTH + page - 1) * ENTRIES_PER_PAGE
+    entries = []
+    if page <= PAGES_PER_MONTH:
+        for article_id in range(first, min(first + ENTRIES_PER_PAGE, total_articles)):
+            entries.append(
+                '<div class="c-compact-river__entry"><div class="c-entry-box--compact">'
+                '<div class="c-entry-box--compact__body">'
+                '<h2 class="c-entry-box--compact__title"><a href="{base}{path}">Synthetic article {id}</a></h2>'
+                '</div></div></div>'.format(base=base_url, path=article_id_to_path(article_id),
+                    id=article_id))
+    return ('<!DOCTYPE html><html><head><title>Archives</title></head><body>'
+        '<div class="c-compact-river">{}</div>'
+        '<button class="c-archives-load-more__button">Load more</button></body></html>'
+        ).format("".join(entries)).encode('utf-8')
+
+
+class BenchmarkServer(object):
+    """
+    Serves the synthetic archive and article pages of a corpus of total_articles articles
+    """
+    archive_pattern = re.compile(r'^/archives/(\d+)/(\d+)(?:/(\d+))?$')
+    article_pattern = re.compile(r'^/\d+/\d+/\d+/(\d+)/')
+
+    def __init__(self, total_articles):
+        benchmark_server = self
+        self.total_articles = total_articles
+        self.bytes_sent = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                archive_match = benchmark_server.archive_pattern.match(self.path)
+                article_match = benchmark_server.article_pattern.match(self.path)
+                if archive_match:
+                    month_index = (int(archive_match.group(1)) - FIRST_YEAR) * 12 + int(archive_match.group(2)) - 1
+                    body = render_archive_page(month_index, int(archive_match.group(3) or 1),
+                        benchmark_server.total_articles, benchmark_server.base_url)
+                elif article_match and int(article_match.group(1)) < benchmark_server.total_articles:
+                    body = render_article_page(int(article_match.group(1)))
+                else:
+                    body = b''
+                self.send_response(200 if body else 404)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                benchmark_server.bytes_sent += len(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_parsing(sample_pages=50):
+    """
+    Per page extraction time for every installed parser backend
+    """
+    from sbnation_html_extraction import available_backends, extract_archive_entries, extract_article
+    article_pages = [render_article_page(article_id) for article_id in range(sample_pages)]
+    archive_pages = [render_archive_page(page // PAGES_PER_MONTH, page % PAGES_PER_MONTH + 1, 10 ** 6)
+        for page in range(sample_pages)]
+    results = {}
+    for backend in available_backends():
+        _, article_seconds = _timed(lambda: [extract_article(page, backend) for page in article_pages])
+        _, archive_seconds = _timed(lambda: [extract_archive_entries(page, backend) for page in archive_pages])
+        results[backend] = {
+            "article_page_ms": 1000.0 * article_seconds / sample_pages,
+            "archive_page_ms": 1000.0 * archive_seconds / sample_pages,
+        }
+    return results
+
+
+def benchmark_checkpoints(articles, work_directory, batch=500):
+    """
+    Cost of one checkpoint of `batch` new articles at the current corpus size,
+    for the json dump and for the append only article store
+    """
+    from sbnation_article_content_scraper import write_articles_to_file
+    from sbnation_article_store import ArticleStore
+    new_keys = list(articles)[-batch:]
+    _, json_seconds = _timed(write_articles_to_file, articles, os.path.join(work_directory, 'checkpoint.json'))
+    store = ArticleStore(os.path.join(work_directory, 'checkpoint_store'))
+    for key in articles:
+        store.append(key, articles[key])
+    store.commit()
+    _, store_seconds = _timed(write_articles_to_file, articles, store.directory, new_keys)
+    return {"json_dump_seconds": json_seconds, "store_append_seconds": store_seconds, "batch": batch}
+
+
+def run_size(total_articles, workers, work_directory):
+    """
+    Runs the whole pipeline against a corpus of total_articles articles, returns the measurements
+    """
+    from sbnation_archive_crawler import scrape_from_sbnation_http
+    from sbnation_article_content_scraper import scrap_content
+    from sbnation_http import AdaptiveThrottle
+    from sbnation_text_file_compiler import compile_txt_files
+
+    months_needed = int(math.ceil(total_articles / float(ENTRIES_PER_PAGE * PAGES_PER_MONTH)))
+    years = range(FIRST_YEAR, FIRST_YEAR + int(math.ceil(months_needed / 12.0)))
+    results = {"articles": total_articles, "workers": workers}
+    with BenchmarkServer(total_articles) as server:
+        archives_root_url = server.base_url + "/archives/"
+        article_infos, list_seconds = _timed(scrape_from_sbnation_http,
+            range(1, 13), years, os.path.join(work_directory, 'article_list.json'), {}, archives_root_url,
+            max_pages=PAGES_PER_MONTH + 1, throttle=AdaptiveThrottle(delay=1e-6, min_delay=1e-6)
+        )
+        results["list"] = {"seconds": list_seconds, "entries": len(article_infos),
+            "entries_per_second": len(article_infos) / list_seconds}
+
+        articles = {}
+        bytes_before = server.bytes_sent
+        _, content_seconds = _timed(scrap_content, article_infos, articles,
+            os.path.join(work_directory, 'articles_store'), workers=workers)
+        results["content"] = {"seconds": content_seconds, "articles": len(articles),
+            "articles_per_second": len(articles) / content_seconds,
+            "megabytes_transferred": (server.bytes_sent - bytes_before) / (1024.0 * 1024.0)}
+
+    results["checkpoint"] = benchmark_checkpoints(articles, work_directory)
+    outputs = {None: os.path.join(work_directory, 'all.txt'), "Author 1": os.path.join(work_directory, 'author_1.txt')}
+    _, compile_seconds = _timed(compile_txt_files, os.path.join(work_directory, 'articles_store'), outputs)
+    results["compile"] = {"seconds": compile_seconds, "articles_per_second": len(articles) / compile_seconds}
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def run_in_subprocess(total_articles, workers):
+    work_directory = tempfile.mkdtemp(prefix='sbnation_benchmark_')
+    result_path = os.path.join(work_directory, 'result.json')
+    try:
+        subprocess.check_call([sys.executable, os.path.abspath(__file__), '--single', str(total_articles),
+            '--workers', str(workers), '--work-directory', work_directory, '--output', result_path],
+            cwd=work_directory)
+        with open(result_path, 'r') as result_file:
+            return json.load(result_file)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the sbnation scraping pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--work-directory', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        results = run_size(args.single, args.workers, args.work_directory)
+    else:
+        results = {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parsing": benchmark_parsing(),
+            "sizes": [run_in_subprocess(size, args.workers) for size in args.sizes],
+        }
+    with open(args.output, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+    if args.single is None:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
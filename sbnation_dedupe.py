@@ -0,0 +1,179 @@
+import hashlib
+import json
+import math
+import os
+import os.path
+import re
+import shutil
+from array import array
+from bisect import bisect_left
+from urllib.parse import urlsplit, urlunsplit
+import logging
+
+import numpy as np
+
+from sbnation_article_store import ArticleStore
+
+logger = logging.getLogger(__name__)
+
+_ARTICLE_KEY_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+
+def canonical_article_url(url):
+    """
+    Normalizes the different ways the same article can be linked to:
+    http/https, host case, default ports, trailing slashes, query strings and fragments
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port not in (80, 443):
+        host = "{}:{}".format(host, parts.port)
+    path = re.sub(r'/{2,}', '/', parts.path).rstrip('/')
+    return urlunsplit(('https', host, path, '', ''))
+
+
+def article_key(url):
+    """
+    Returns the 64 bit key of an article as a 16 character hex string.
+    Keys are strings so that they stay the same after a json dump and load
+    """
+    return hashlib.blake2b(canonical_article_url(url).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def is_article_key(key):
+    return isinstance(key, str) and _ARTICLE_KEY_PATTERN.match(key) is not None
+
+
+class BloomFilter(object):
+    """
+    Bloom filter over 64 bit integers, sized for `capacity` items at `error_rate` false positives
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # double hashing, the two halves of the (already uniformly distributed) key
+        low, high = value & 0xffffffff, (value >> 32) | 1
+        for i in range(self.hash_count):
+            yield (low + i * high) % self.size
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def add_many(self, values):
+        """
+        Adds a numpy uint64 array of values, setting the same bits as add() for each of them
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        low = (values & np.uint64(0xffffffff)).astype(np.int64)
+        high = ((values >> np.uint64(32)) | np.uint64(1)).astype(np.int64)
+        flags = np.zeros(len(self._bits) * 8, dtype=bool)
+        for i in range(self.hash_count):
+            flags[(low + i * high) % self.size] = True
+        bits = np.frombuffer(self._bits, dtype=np.uint8)
+        bits |= np.packbits(flags, bitorder='little')
+
+    def __contains__(self, value):
+        for position in self._positions(value):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class ArticleKeySet(object):
+    """
+    Compact exact set of article keys, 8 bytes per key held in a sorted array.
+    Recently added keys are kept in a small python set and merged into the array in batches,
+    and a bloom filter in front answers most lookups for unknown keys without a binary search
+    """
+    def __init__(self, keys=(), merge_threshold=100000):
+        self.merge_threshold = merge_threshold
+        self._sorted = array('Q', np.unique(np.fromiter((int(key, 16) for key in keys), dtype=np.uint64)).tobytes())
+        self._recent = set()
+        self._rebuild_bloom()
+
+    def _rebuild_bloom(self):
+        self._bloom_capacity = 2 * len(self) + self.merge_threshold
+        self._bloom = BloomFilter(self._bloom_capacity)
+        self._bloom.add_many(np.frombuffer(self._sorted, dtype=np.uint64))
+        self._bloom.add_many(np.fromiter(self._recent, dtype=np.uint64, count=len(self._recent)))
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def __contains__(self, key):
+        value = int(key, 16)
+        if value not in self._bloom:
+            return False
+        if value in self._recent:
+            return True
+        i = bisect_left(self._sorted, value)
+        return i < len(self._sorted) and self._sorted[i] == value
+
+    def add(self, key):
+        if key in self:
+            return
+        value = int(key, 16)
+        self._recent.add(value)
+        self._bloom.add(value)
+        if len(self._recent) >= self.merge_threshold:
+            self._sorted = array('Q', sorted(self._sorted.tolist() + list(self._recent)))
+            self._recent = set()
+        # the bloom filter already holds every key, it only needs rebuilding once it gets too full
+        if len(self) > self._bloom_capacity:
+            self._rebuild_bloom()
+
+
+def has_legacy_keys(dic):
+    return any(not is_article_key(key) for key in dic)
+
+
+def migrate_keys(dic):
+    """
+    Returns a new dictionary keyed by article_key(url), built from one keyed by the
+    old date+title+author hashes. Entries for the same canonical url are merged,
+    the first one wins
+    """
+    migrated = {}
+    for value in dic.values():
+        key = article_key(value['url'])
+        if key not in migrated:
+            migrated[key] = value
+    logger.info("Migrated {} entries to {} url keyed entries".format(len(dic), len(migrated)))
+    return migrated
+
+
+def migrate_file(fname):
+    """
+    Rewrite an article list / articles json file or an article store with url based keys
+    """
+    if os.path.isdir(fname):
+        migrated_directory = fname.rstrip('/\\') + '.migrating'
+        shutil.rmtree(migrated_directory, ignore_errors=True)
+        store = ArticleStore(migrated_directory)
+        seen = set()
+        for i, (_, article) in enumerate(ArticleStore(fname).iter_latest_items()):
+            key = article_key(article['url'])
+            if key in seen:
+                continue
+            seen.add(key)
+            store.append(key, article)
+            if i % 500 == 0:
+                store.commit()
+        store.commit()
+        # swap the directories so that a crash never leaves us without one complete store
+        backup_directory = fname.rstrip('/\\') + '.pre-migration'
+        os.replace(fname, backup_directory)
+        os.replace(migrated_directory, fname)
+        shutil.rmtree(backup_directory)
+        logger.info("Migrated article store {}, {} articles".format(fname, len(seen)))
+        return
+    with open(fname, 'r') as infile:
+        dic = json.load(infile)
+    with open(fname + '.tmp', 'w') as outfile:
+        json.dump(migrate_keys(dic), outfile)
+    os.replace(fname + '.tmp', fname)
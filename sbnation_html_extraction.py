@@ -0,0 +1,255 @@
+from bs4 import BeautifulSoup, SoupStrainer
+import sys
+import time
+import logging
+from sbnation_logging import setup_logging
+from sbnation_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def _has_class(*class_names):
+    """
+    Returns a SoupStrainer attribute matcher for elements having any of class_names.
+    Depending on the bs4 version the matcher gets either single classes or the whole class attribute
+    """
+    class_names = set(class_names)
+
+    def matches(value):
+        if value is None:
+            return False
+        if isinstance(value, str):
+            value = value.split()
+        return not class_names.isdisjoint(value)
+    return matches
+
+
+# Only these subtrees of the pages are ever looked at, everything else is skipped while parsing
+ARTICLE_PARSE_ONLY = SoupStrainer('div', attrs={"class": _has_class("c-entry-hero", "c-entry-content")})
+ARCHIVE_PARSE_ONLY = SoupStrainer('div', attrs={"class": _has_class("c-entry-box--compact__body")})
+
+BACKENDS = ("html.parser", "lxml", "selectolax")
+
+# whitespace only strings outside these tags are collapsed by bs4, see _selectolax_text
+BS4_SPACES = "\x20\x0a\x09\x0c\x0d"
+BS4_PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+
+
+def available_backends():
+    """
+    Returns the parser backends which can be used with the installed packages
+    """
+    backends = ["html.parser"]
+    try:
+        import lxml
+        backends.append("lxml")
+    except ImportError:
+        pass
+    try:
+        from selectolax.lexbor import LexborHTMLParser
+        backends.append("selectolax")
+    except ImportError:
+        pass
+    return backends
+
+
+def parse_html(markup, backend="html.parser", parse_only=None):
+    """
+    Returns a bs4 object for markup, parsing only the subtrees matched by parse_only (a SoupStrainer)
+    :param: backend : 'html.parser' or 'lxml'
+    """
+    if backend not in ("html.parser", "lxml"):
+        raise ValueError("{} cannot build a bs4 object, use html.parser or lxml".format(backend))
+    return BeautifulSoup(markup, backend, parse_only=parse_only)
+
+
+def _selectolax_tree(markup):
+    from selectolax.lexbor import LexborHTMLParser
+    if isinstance(markup, bytes):
+        markup = markup.decode('utf-8', errors='replace')
+    tree = LexborHTMLParser(markup)
+    # bs4 leaves the text of scripts and stylesheets out of .text, selectolax does not
+    tree.strip_tags(['script', 'style'])
+    return tree
+
+
+def _selectolax_text(node):
+    """
+    Returns the text of node the way bs4 .text builds it: strings made of whitespace only
+    become a newline (a space if they have no newline), except inside pre and textarea
+    """
+    parts = []
+    for child in node.traverse(include_text=True):
+        if not child.is_text_node:
+            continue
+        text = child.text(deep=False)
+        if not text.strip(BS4_SPACES):
+            parent = child.parent
+            while parent is not None and parent.tag not in BS4_PRESERVE_WHITESPACE_TAGS:
+                parent = parent.parent
+            if parent is None:
+                text = "\n" if "\n" in text else " "
+        parts.append(text)
+    return "".join(parts)
+
+
+def _selectolax_find(node, tag, class_string):
+    """
+    Returns the first tag under node matching class_string the way bs4 find(tag, attrs={"class": class_string})
+    does: a single class matches any element having it, several classes only match the whole class attribute
+    """
+    class_names = class_string.split()
+    for candidate in node.css("{}.{}".format(tag, class_names[0])):
+        if len(class_names) == 1 or " ".join((candidate.attributes.get('class') or "").split()) == class_string:
+            return candidate
+    return None
+
+
+def extract_article(markup, backend="html.parser"):
+    """
+    Returns a dictionary with the summary, author and body found on an article page.
+    Any of them which could not be found is None
+    """
+    article, parse_seconds = extract_article_timed(markup, backend)
+    metrics.observe('parse', parse_seconds, page='article')
+    return article
+
+
+def extract_article_timed(markup, backend="html.parser"):
+    """
+    Same as extract_article, but returns (article, seconds spent parsing the page) instead of
+    observing the parse time, for callers running it in another process (see sbnation_pipeline)
+    """
+    summary = author = body = None
+    start = time.perf_counter()
+    if backend == "selectolax":
+        tree = _selectolax_tree(markup)
+        parse_seconds = time.perf_counter() - start
+        header_div = _selectolax_find(tree, 'div', "c-entry-hero c-entry-hero--default")
+        if header_div is not None:
+            summary_h2 = _selectolax_find(header_div, 'h2', "c-entry-summary")
+            author_span = _selectolax_find(header_div, 'span', "c-byline__author-name")
+            summary = _selectolax_text(summary_h2) if summary_h2 is not None else None
+            author = _selectolax_text(author_span) if author_span is not None else None
+        body_div = _selectolax_find(tree, 'div', "c-entry-content")
+        body = _selectolax_text(body_div) if body_div is not None else None
+    else:
+        soup = parse_html(markup, backend, parse_only=ARTICLE_PARSE_ONLY)
+        parse_seconds = time.perf_counter() - start
+        header_div = soup.find('div', attrs={"class":"c-entry-hero c-entry-hero--default"})
+        if header_div is not None:
+            summary_h2 = header_div.find('h2', attrs={"class":"c-entry-summary"})
+            author_span = header_div.find('span', attrs={"class":"c-byline__author-name"})
+            summary = summary_h2.text if summary_h2 is not None else None
+            author = author_span.text if author_span is not None else None
+        body_div = soup.find('div', attrs={"class":"c-entry-content"})
+        body = body_div.text if body_div is not None else None
+    return {"summary": summary, "author": author, "body": body}, parse_seconds
+
+
+def archive_entries_from_soup(bs4_content):
+    """
+    Returns (title, url, author, date) for every entry of a bs4 archive page,
+    author and date are None when the entry has no detailed byline
+    """
+    entries = []
+    for entry in bs4_content.findAll('div', attrs={"class":"c-entry-box--compact__body"}):
+        h2 = entry.find('h2', attrs={"class": 'c-entry-box--compact__title'})
+        a = h2.find('a')
+        author = _date = None
+        byline_div = entry.find('div', attrs={"class":"c-byline"})
+        if byline_div is not None:
+            spans = byline_div.findAll('span', attrs={"class":"c-byline__item"})
+            if len(spans) == 2:
+                author = spans[0].find('a').text
+                _date = spans[1].find('time')['datetime']
+        entries.append((a.text, a['href'], author, _date))
+    return entries
+
+
+# the same extraction as archive_entries_from_soup, run inside the browser by the selenium list scraper.
+# Returns [title, url, author, date] for the entries from index arguments[0] on
+ARCHIVE_ENTRIES_SCRIPT = """
+var entries = document.querySelectorAll('div.c-entry-box--compact__body');
+var result = [];
+for (var i = arguments[0]; i < entries.length; i++) {
+    var a = entries[i].querySelector('h2.c-entry-box--compact__title a');
+    var author = null, date = null;
+    var byline = entries[i].querySelector('div.c-byline');
+    if (byline !== null) {
+        var spans = byline.querySelectorAll('span.c-byline__item');
+        if (spans.length === 2) {
+            author = spans[0].querySelector('a').textContent;
+            date = spans[1].querySelector('time').getAttribute('datetime');
+        }
+    }
+    result.push([a.textContent, a.getAttribute('href'), author, date]);
+}
+return result;
+"""
+
+
+def extract_archive_entries(markup, backend="html.parser"):
+    """
+    Returns (title, url, author, date) for every entry on an archive page,
+    author and date are None when the entry has no detailed byline
+    """
+    if backend != "selectolax":
+        with metrics.timer('parse', page='archive'):
+            soup = parse_html(markup, backend, parse_only=ARCHIVE_PARSE_ONLY)
+        return archive_entries_from_soup(soup)
+    entries = []
+    with metrics.timer('parse', page='archive'):
+        tree = _selectolax_tree(markup)
+    for entry in tree.css('div.c-entry-box--compact__body'):
+        a = entry.css_first('h2.c-entry-box--compact__title').css_first('a')
+        author = _date = None
+        byline_div = entry.css_first('div.c-byline')
+        if byline_div is not None:
+            spans = byline_div.css('span.c-byline__item')
+            if len(spans) == 2:
+                author = _selectolax_text(spans[0].css_first('a'))
+                _date = spans[1].css_first('time').attributes['datetime']
+        entries.append((_selectolax_text(a), a.attributes['href'], author, _date))
+    return entries
+
+
+def check_backend_conformance(markups, backends=None):
+    """
+    Extracts every page in markups with every backend and returns a list of
+    (page number, backend, reference result, backend result) for every mismatch
+    against html.parser. An empty list means all backends agree
+    """
+    if backends is None:
+        backends = available_backends()
+    mismatches = []
+    for page_number, markup in enumerate(markups):
+        reference_article = extract_article(markup, "html.parser")
+        reference_entries = extract_archive_entries(markup, "html.parser")
+        for backend in backends:
+            article = extract_article(markup, backend)
+            if article != reference_article:
+                mismatches.append((page_number, backend, reference_article, article))
+            entries = extract_archive_entries(markup, backend)
+            if entries != reference_entries:
+                mismatches.append((page_number, backend, reference_entries, entries))
+    return mismatches
+
+
+"""
+Pass saved article and archive html pages to check that all the installed
+parser backends extract exactly the same values from them
+"""
+if __name__ == "__main__":
+    setup_logging()
+    markups = []
+    for html_file_path in sys.argv[1:]:
+        with open(html_file_path, 'rb') as html_file:
+            markups.append(html_file.read())
+    backends = available_backends()
+    mismatches = check_backend_conformance(markups, backends)
+    for page_number, backend, expected, found in mismatches:
+        logger.error("{} differs on {}:\nexpected {}\nfound {}".format(
+            backend, sys.argv[1 + page_number], expected, found))
+    logger.info("Checked {} pages with backends {}, {} mismatches".format(
+        len(markups), backends, len(mismatches)))
+    sys.exit(1 if mismatches else 0)
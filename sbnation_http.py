@@ -0,0 +1,233 @@
+import threading
+import time
+import logging
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from sbnation_http_cache import CacheMiss, conditional_headers
+from sbnation_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    Simple thread safe token bucket, refilled continuously at `rate` tokens per second
+    and holding at most `capacity` tokens
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class AdaptiveThrottle(object):
+    """
+    AIMD (additive increase, multiplicative decrease) request pacer.
+    Every clean response adds `increase_step` requests/second to the allowed rate, every
+    blocked/empty response multiplies it by `backoff_factor`. The delay between requests is
+    always kept between min_delay and max_delay seconds
+    """
+    def __init__(self, delay=2.0, min_delay=0.25, max_delay=60.0,
+        increase_step=0.05, backoff_factor=0.5):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.increase_step = increase_step
+        self.backoff_factor = backoff_factor
+        self.block_events = []
+        self._rate = 1.0 / delay
+        self._next_request_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        """
+        Current allowed requests per second
+        """
+        return self._rate
+
+    @property
+    def delay(self):
+        return 1.0 / self._rate
+
+    def _set_rate(self, rate):
+        self._rate = min(max(rate, 1.0 / self.max_delay), 1.0 / self.min_delay)
+
+    def wait(self):
+        """
+        Block until the next request is allowed
+        """
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_request_at)
+            self._next_request_at = start_at + self.delay
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def record_success(self):
+        with self._lock:
+            self._set_rate(self._rate + self.increase_step)
+
+    def record_block(self, url, reason):
+        """
+        Back off after a blocked, throttled or unexpectedly empty response
+        """
+        metrics.inc('block_events', reason=reason)
+        with self._lock:
+            self._set_rate(self._rate * self.backoff_factor)
+            self._next_request_at = max(self._next_request_at, time.monotonic() + self.delay)
+            self.block_events.append({"time": time.time(), "url": url, "reason": reason, "delay": self.delay})
+        logger.info("Backing off to one request every {:.2f}s after {} ({})".format(self.delay, reason, url))
+
+
+class HostRateLimiter(object):
+    """
+    Keeps one token bucket per host, so that each sbnation site is throttled on its own
+    :param: requests_per_second : allowed sustained request rate per host (None = unlimited)
+    :param: burst : number of requests allowed back to back before throttling kicks in
+    """
+    def __init__(self, requests_per_second=None, burst=1):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        if not self.requests_per_second:
+            return
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.requests_per_second, self.burst)
+                self._buckets[host] = bucket
+        bucket.acquire()
+
+
+def new_session(pool_size=10):
+    """
+    Returns a requests session whose connection pool can keep `pool_size` connections alive per host
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class Fetcher(object):
+    """
+    Fetches urls over pooled keep-alive connections, honouring the per host rate limit.
+    Safe to share between threads, every thread gets its own session (requests sessions
+    are not guaranteed to be thread safe)
+    :param: workers : number of threads expected to use this fetcher, sizes the connection pools
+    :param: requests_per_second : per host rate limit (None = unlimited)
+    :param: burst : per host token bucket capacity
+    :param: throttle : optional AdaptiveThrottle, told about every clean or throttled response
+    :param: cache : optional ResponseCache. Cached responses are revalidated with the server
+    (a 304 answer costs no body download), or returned directly if the cache is offline
+    :param: slots : optional threading.BoundedSemaphore shared by several fetchers,
+    bounds the number of requests in flight across all of them
+    :param: retries : number of times a request which timed out, could not connect or got a 5xx
+    answer is tried again, waiting retry_backoff, 2*retry_backoff, 4*retry_backoff... seconds in between
+    """
+    blocked_status_codes = (403, 429, 503)
+    retry_status_codes = (500, 502, 503, 504)
+
+    def __init__(self, workers=1, requests_per_second=None, burst=1, timeout=15, throttle=None,
+        cache=None, slots=None, retries=0, retry_backoff=1.0):
+        self.workers = workers
+        self.timeout = timeout
+        self.throttle = throttle
+        self.cache = cache
+        self.slots = slots
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.rate_limiter = HostRateLimiter(requests_per_second, burst)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = new_session(pool_size=max(self.workers, 1))
+            self._local.session = session
+        return session
+
+    def get(self, url):
+        cached = None
+        headers = {}
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            if self.cache.offline:
+                if cached is None:
+                    metrics.inc('cache_misses')
+                    raise CacheMiss(url)
+                metrics.inc('cache_hits')
+                return cached
+            if cached is not None:
+                headers = conditional_headers(cached)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                response = self._request(url, headers)
+            except (requests.Timeout, requests.ConnectionError) as error:
+                if attempt == self.retries:
+                    raise
+                logger.debug("Retrying {} after {}".format(url, error))
+                metrics.inc('retries', reason=type(error).__name__)
+                continue
+            if response.status_code not in self.retry_status_codes or attempt == self.retries:
+                break
+            logger.debug("Retrying {} after status {}".format(url, response.status_code))
+            metrics.inc('retries', reason="status_{}".format(response.status_code))
+        if cached is not None and response.status_code == 304:
+            logger.debug("{} not modified, using cached copy".format(url))
+            metrics.inc('cache_hits')
+            return cached
+        if self.cache is not None:
+            self.cache.put(url, response)
+        return response
+
+    def _request(self, url, headers):
+        with metrics.timer('rate_limit_wait'):
+            self.rate_limiter.acquire(url)
+            if self.throttle is not None:
+                self.throttle.wait()
+        logger.debug("Fetching {}".format(url))
+        if self.slots is not None:
+            with metrics.timer('slot_wait'):
+                self.slots.acquire()
+        try:
+            with metrics.timer('fetch'):
+                response = self.session.get(url, timeout=self.timeout, headers=headers)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+        metrics.inc('responses', status=response.status_code)
+        metrics.inc('bytes_transferred', len(response.content))
+        if self.throttle is not None:
+            if response.status_code in self.blocked_status_codes:
+                self.throttle.record_block(url, "status {}".format(response.status_code))
+            else:
+                self.throttle.record_success()
+        return response
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import os.path
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMiss(Exception):
+    """
+    Raised in offline mode for urls which are not in the cache
+    """
+    pass
+
+
+class CachedResponse(object):
+    """
+    The parts of a requests response which are kept in the cache
+    """
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+def conditional_headers(cached):
+    """
+    Returns the request headers to revalidate a CachedResponse with the server
+    """
+    headers = {}
+    for name, value in cached.headers.items():
+        if name.lower() == 'etag':
+            headers['If-None-Match'] = value
+        elif name.lower() == 'last-modified':
+            headers['If-Modified-Since'] = value
+    return headers
+
+
+class ResponseCache(object):
+    """
+    On disk http response cache keyed by the sha256 of the url. Every entry is a .body file
+    holding the raw content next to a .json file with the url, headers and validators
+    (ETag / Last-Modified). The least recently used entries are evicted once the bodies take
+    more than max_bytes
+    :param: offline : only ever answer from the cache, never touch the network
+    """
+    def __init__(self, directory, max_bytes=4 * 1024 ** 3, offline=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def _paths(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, digest[:2], digest)
+        return base + '.json', base + '.body'
+
+    def get(self, url):
+        """
+        Returns the CachedResponse for url, or None if it is not cached
+        """
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+            with open(body_path, 'rb') as body_file:
+                content = body_file.read()
+        except (OSError, ValueError):
+            return None
+        if meta['url'] != url:
+            return None
+        # the mtime of the metadata file is the last access time used for LRU eviction
+        os.utime(meta_path)
+        return CachedResponse(url, meta['status_code'], meta['headers'], content)
+
+    def put(self, url, response):
+        """
+        Store a successful response for url
+        """
+        if response.status_code != 200:
+            return
+        meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        previous_size = os.path.getsize(body_path) if os.path.isfile(body_path) else 0
+        # write to temporary files first so that readers never see half written entries
+        with open(body_path + '.tmp', 'wb') as body_file:
+            body_file.write(response.content)
+        with open(meta_path + '.tmp', 'w') as meta_file:
+            json.dump({"url": url, "status_code": response.status_code,
+                "headers": dict(response.headers)}, meta_file)
+        os.replace(body_path + '.tmp', body_path)
+        os.replace(meta_path + '.tmp', meta_path)
+        with self._lock:
+            self._total_bytes = self.total_bytes() + len(response.content) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def total_bytes(self):
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, _, size in self._entries())
+        return self._total_bytes
+
+    def _entries(self):
+        """
+        Yields (meta path, last access time, body size) of every cached entry
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for subdirectory in os.listdir(self.directory):
+            subdirectory = os.path.join(self.directory, subdirectory)
+            if not os.path.isdir(subdirectory):
+                continue
+            for name in os.listdir(subdirectory):
+                if not name.endswith('.json'):
+                    continue
+                meta_path = os.path.join(subdirectory, name)
+                body_path = meta_path[:-len('.json')] + '.body'
+                try:
+                    yield meta_path, os.path.getmtime(meta_path), os.path.getsize(body_path)
+                except OSError:
+                    continue
+
+    def _evict(self):
+        # evict down to 90% of the cap so that eviction does not run on every put
+        target = self.max_bytes * 0.9
+        for meta_path, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self._total_bytes <= target:
+                break
+            for path in (meta_path, meta_path[:-len('.json')] + '.body'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total_bytes -= size
+        logger.debug("Evicted cache entries, cache now holds {} bytes".format(self._total_bytes))
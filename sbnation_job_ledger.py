@@ -0,0 +1,138 @@
+import hashlib
+import sqlite3
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+DEAD = 'dead'
+
+# skip reasons (see sbnation_article_content_scraper.ArticleSkipped) which retrying cannot fix
+PERMANENT_REASONS = ('status_404', 'status_410', 'no_author', 'no_body')
+
+
+def list_signature(article_infos):
+    """
+    Returns a hash of the keys of article_infos, which changes whenever an article is added,
+    removed or rekeyed (the key is a hash of the url)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for key in article_infos:
+        digest.update(key.encode('utf-8'))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class JobLedger(object):
+    """
+    Durable record of the state of every article to scrape, kept in an sqlite database.
+    Every article is pending, done, failed (with the reason, the number of attempts and the time
+    of the next retry) or dead (failed permanently or too often). Resuming only reads the
+    outstanding articles instead of going through the whole article list.
+    Changes are buffered until commit(), which scrap_content calls at every checkpoint
+    after the articles themselves are written
+    :param: max_attempts : failed articles become dead after this many attempts
+    :param: retry_backoff : seconds before the first retry of a failed article, doubled at every attempt
+    """
+    def __init__(self, path, max_attempts=5, retry_backoff=60.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, url TEXT NOT NULL, "
+            "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, reason TEXT, "
+            "next_attempt REAL NOT NULL DEFAULT 0)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, next_attempt)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._connection.commit()
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def sync(self, article_infos, articles):
+        """
+        Adds the articles of article_infos the ledger does not know about yet, as done if they are
+        already in articles and pending otherwise. Nothing is done when the ledger was last synced
+        with the same article list (see list_signature).
+        Articles which are no longer in article_infos (e.g. rekeyed by sbnation_dedupe.migrate_keys)
+        are kept, scrap_content skips them
+        """
+        signature = list_signature(article_infos)
+        row = self._connection.execute("SELECT value FROM meta WHERE name = 'synced_list'").fetchone()
+        if row is not None and row[0] == signature:
+            return 0
+        before = len(self)
+        self._connection.executemany("INSERT OR IGNORE INTO jobs (key, url, state) VALUES (?, ?, ?)",
+            ((key, value['url'], DONE if key in articles else PENDING) for key, value in article_infos.items()))
+        self._connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('synced_list', ?)",
+            (signature,))
+        self._connection.commit()
+        added = len(self) - before
+        logger.info("Added {} articles to the job ledger {}".format(added, self.path))
+        return added
+
+    def outstanding(self, retry_failed_only=False, now=None):
+        """
+        Returns the keys of the pending articles and of the failed ones due for a retry,
+        or only of the latter if retry_failed_only
+        """
+        now = time.time() if now is None else now
+        query = "SELECT key FROM jobs WHERE (state = ? AND next_attempt <= ?)"
+        if not retry_failed_only:
+            query += " OR state = '{}'".format(PENDING)
+        return [key for key, in self._connection.execute(query + " ORDER BY rowid", (FAILED, now))]
+
+    def mark_done(self, key):
+        self._connection.execute("UPDATE jobs SET state = ?, reason = NULL WHERE key = ?", (DONE, key))
+
+    def mark_failed(self, key, reason, permanent=None):
+        """
+        Records a failed attempt at key. The article is retried after an exponential backoff,
+        unless the failure is permanent (by default decided from PERMANENT_REASONS)
+        or it has been tried max_attempts times already
+        """
+        if permanent is None:
+            permanent = reason in PERMANENT_REASONS
+        row = self._connection.execute("SELECT attempts FROM jobs WHERE key = ?", (key,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        state = DEAD if permanent or attempts >= self.max_attempts else FAILED
+        next_attempt = time.time() + self.retry_backoff * 2 ** (attempts - 1)
+        self._connection.execute("UPDATE jobs SET state = ?, attempts = ?, reason = ?, next_attempt = ? "
+            "WHERE key = ?", (state, attempts, reason, next_attempt, key))
+
+    def revive(self, reason=None):
+        """
+        Makes dead articles (only those which died of reason, if given) pending again
+        """
+        query = "UPDATE jobs SET state = ?, attempts = 0, next_attempt = 0 WHERE state = ?"
+        parameters = (PENDING, DEAD)
+        if reason is not None:
+            query += " AND reason = ?"
+            parameters += (reason,)
+        revived = self._connection.execute(query, parameters).rowcount
+        self._connection.commit()
+        return revived
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    def counts(self):
+        """
+        Returns the number of articles in every state
+        """
+        return dict(self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def failures(self):
+        """
+        Returns the number of failed and dead articles per reason
+        """
+        return dict(self._connection.execute(
+            "SELECT reason, COUNT(*) FROM jobs WHERE state IN (?, ?) GROUP BY reason", (FAILED, DEAD)))
@@ -0,0 +1,52 @@
+import logging
+import logging.handlers
+
+DETAILED_FORMATTER = logging.Formatter(fmt=
+    ("%(asctime)-22s - %(name)-4s - %(levelname)-4s - "
+    "%(filename)-5s - %(lineno)-2s - "
+    "%(funcName)-5s \n%(message)s")
+)
+SIMPLE_FORMATTER = logging.Formatter('%(name)s: %(levelname)s: %(message)s')
+
+# handlers added by the last setup_logging call
+_handlers = []
+
+
+class _ScraperRecordsFilter(logging.Filter):
+    """
+    Lets through every record of the sbnation modules (and of the script being run),
+    but only the warnings and errors of the libraries they use
+    """
+    def filter(self, record):
+        return record.name.startswith('sbnation') or record.name == '__main__' or record.levelno >= logging.WARNING
+
+
+def setup_logging(log_file="sbnation.log", console_level=logging.INFO, file_level=logging.DEBUG):
+    """
+    Configures logging for a whole run, call it once at startup instead of at import time.
+    Debug messages go to log_file, which is appended to (and rotated every 10MB) instead of truncated,
+    info messages to the console. Calling it again replaces the handlers of the previous call,
+    so a batch job calling it for every run does not get duplicated messages
+    :param: log_file : None to only log to the console
+    """
+    root = logging.getLogger()
+    for handler in _handlers:
+        root.removeHandler(handler)
+        handler.close()
+    del _handlers[:]
+
+    # create console handler with a higher log level
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(SIMPLE_FORMATTER)
+    _handlers.append(console_handler)
+    if log_file is not None:
+        # create file handler which logs even debug messages
+        file_handler = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=1e7, backupCount=4)
+        file_handler.setLevel(file_level)
+        file_handler.setFormatter(DETAILED_FORMATTER)
+        _handlers.append(file_handler)
+    for handler in _handlers:
+        handler.addFilter(_ScraperRecordsFilter())
+        root.addHandler(handler)
+    root.setLevel(min(handler.level for handler in _handlers))
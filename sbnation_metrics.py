@@ -0,0 +1,187 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _series_name(name, labels):
+    if not labels:
+        return name
+    return "{}{{{}}}".format(name, ",".join('{}="{}"'.format(label, value) for label, value in labels))
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram, observing a value is a binary search and two additions
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {"buckets": dict(zip([str(bucket) for bucket in self.buckets] + ["+Inf"], self.counts)),
+            "sum": self.sum, "count": self.count}
+
+
+class Metrics(object):
+    """
+    Registry of counters and latency histograms, safe to update from several threads.
+    Series are identified by a name and optional labels, e.g.
+    metrics.inc('articles_skipped', reason='no_body') or with metrics.timer('fetch'): ...
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observes the time spent in the with block in the `name` latency histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self._started = time.time()
+
+    def snapshot(self):
+        """
+        Returns all the series as a json serializable dictionary,
+        every counter also gets its average rate per second since the start
+        """
+        with self._lock:
+            uptime = max(time.time() - self._started, 1e-9)
+            counters = dict((_series_name(name, labels), value) for (name, labels), value in self._counters.items())
+            histograms = dict((_series_name(name, labels), histogram.snapshot())
+                for (name, labels), histogram in self._histograms.items())
+        return {"uptime_seconds": uptime, "counters": counters,
+            "rates_per_second": dict((name, value / uptime) for name, value in counters.items()),
+            "latency_seconds": histograms}
+
+    def to_prometheus(self, prefix='sbnation_'):
+        """
+        Returns all the series in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append("{} {}".format(_series_name(prefix + name + '_total', labels), value))
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bucket, count in zip([str(bucket) for bucket in histogram.buckets] + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append("{} {}".format(
+                        _series_name(prefix + name + '_seconds_bucket', labels + (('le', bucket),)), cumulative))
+                lines.append("{} {}".format(_series_name(prefix + name + '_seconds_sum', labels), histogram.sum))
+                lines.append("{} {}".format(_series_name(prefix + name + '_seconds_count', labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Atomically write the metrics to path, in Prometheus text format if path ends in .prom
+        and as json otherwise
+        """
+        with open(path + '.tmp', 'w') as outfile:
+            if path.endswith('.prom'):
+                outfile.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), outfile, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+# the registry used by all the scraper modules
+metrics = Metrics()
+
+
+class MetricsExporter(object):
+    """
+    Background thread writing the metrics to each of paths every interval seconds (and once more on stop)
+    """
+    def __init__(self, paths, interval=10.0, registry=metrics):
+        self.paths = paths
+        self.interval = interval
+        self.registry = registry
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        for path in self.paths:
+            try:
+                self.registry.write(path)
+            except OSError as error:
+                logger.warning("Couldnt write metrics to {}: {}".format(path, error))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+@contextmanager
+def profiled(path=None):
+    """
+    Runs the with block under cProfile and dumps the stats to path (no-op when path is None),
+    inspect them with python3 -m pstats <path>
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        logger.info("Wrote profile to {}".format(path))
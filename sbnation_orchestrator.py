@@ -0,0 +1,224 @@
+"""
+Scrapes several SB Nation websites from one process, driven by a json config file:
+
+    {
+        "max_concurrent_requests": 8,
+        "max_parallel_sites": 4,
+        "per_domain_concurrency": 2,
+        "requests_per_second": 2,
+        "sites": [
+            {"name": "bb", "archives_root_url": "https://www.barcablaugranes.com/archives/",
+             "years": [2018, 2019], "months": [1, 12], "output_dir": "scrapped_data/bb"},
+            {"name": "mm", "archives_root_url": "https://www.managingmadrid.com/archives/",
+             "years": [2019, 2019], "output_dir": "scrapped_data/mm", "requests_per_second": 1}
+        ]
+    }
+
+years and months are inclusive [first, last] ranges (months default to the whole year), and any of
+the top level settings can be overridden per site. Every site is worked on in small steps (one archive
+month, or one batch of articles) taken round robin, so a huge site does not starve the others.
+Each site writes <name>_article_list.json, the <name>_articles article store and progress.json to its
+output_dir, and a rerun picks every site up where it stopped.
+
+    python3 sbnation_orchestrator.py sites.json
+"""
+import json
+import os
+import os.path
+import sys
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+from urllib.parse import urlsplit
+import logging
+import requests
+from sbnation_logging import setup_logging
+from sbnation_archive_crawler import crawl_archive_month
+from sbnation_article_content_scraper import get_existing_articles, scrap_content
+from sbnation_article_list_scraper import get_existing_articles_list
+from sbnation_article_store import dump_json
+from sbnation_dedupe import ArticleKeySet
+from sbnation_http import AdaptiveThrottle, Fetcher
+from sbnation_metrics import MetricsExporter, metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "max_concurrent_requests": 8,
+    "max_parallel_sites": 4,
+    "per_domain_concurrency": 2,
+    "requests_per_second": 2,
+    "throttle_delay": 0.5,
+    "max_pages": 100,
+    "retries": 3,
+    "batch_size": 200,
+    "backend": "html.parser",
+    "months": [1, 12],
+}
+
+
+class Site(object):
+    """
+    One website of the config. Its work is a generator which does one step (an archive month,
+    or a batch of articles) per next() call, so the scheduler can interleave the sites
+    """
+    def __init__(self, config, fetcher):
+        self.name = config['name']
+        self.config = config
+        self.fetcher = fetcher
+        self.archives_root_url = config['archives_root_url']
+        self.domain = urlsplit(self.archives_root_url).hostname
+        output_dir = config['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+        self.list_path = os.path.join(output_dir, self.name + '_article_list.json')
+        self.articles_path = os.path.join(output_dir, self.name + '_articles')
+        self.progress_path = os.path.join(output_dir, 'progress.json')
+        self._steps = self._run()
+
+    def step(self):
+        """
+        Does the next step of work, returns False once the site is done
+        """
+        return next(self._steps, False)
+
+    def _load_progress(self):
+        if os.path.isfile(self.progress_path):
+            with open(self.progress_path, 'r') as progress_file:
+                return json.load(progress_file)
+        return {"listed_months": []}
+
+    def _months(self):
+        first_year, last_year = self.config['years']
+        first_month, last_month = self.config['months']
+        for year in range(first_year, last_year + 1):
+            for month in range(first_month, last_month + 1):
+                yield year, month
+
+    def _run(self):
+        progress = self._load_progress()
+        listed_months = set(progress['listed_months'])
+        article_infos = get_existing_articles_list(self.list_path)
+        known_keys = ArticleKeySet(article_infos)
+        today = date.today()
+        for year, month in self._months():
+            month_id = "{}-{}".format(year, month)
+            if month_id in listed_months:
+                continue
+            crawled = True
+            try:
+                article_infos = crawl_archive_month(month, year, self.fetcher, self.archives_root_url,
+                    article_infos, max_pages=self.config['max_pages'], backend=self.config['backend'],
+                    known_keys=known_keys)
+            except requests.RequestException as error:
+                # the entries found before the error are kept, the month is crawled again on the next run
+                logger.error("{}: couldnt crawl the archives of {}: {}".format(self.name, month_id, error))
+                metrics.inc('archive_month_errors', reason=type(error).__name__)
+                crawled = False
+            dump_json(article_infos, self.list_path)
+            # months which are not over yet get new articles, crawl them again on the next run
+            if crawled and (year, month) < (today.year, today.month):
+                listed_months.add(month_id)
+                progress['listed_months'].append(month_id)
+                dump_json(progress, self.progress_path)
+            logger.info("{}: listed {}, {} article infos".format(self.name, month_id, len(article_infos)))
+            yield True
+
+        articles = get_existing_articles(self.articles_path, load_bodies=False)
+        pending = [key for key in article_infos if key not in articles]
+        logger.info("{}: {} articles to scrape".format(self.name, len(pending)))
+        batch_size = self.config['batch_size']
+        for start in range(0, len(pending), batch_size):
+            batch = dict((key, article_infos[key]) for key in pending[start:start + batch_size])
+            scrap_content(batch, articles, self.articles_path, workers=self.config['per_domain_concurrency'],
+                backend=self.config['backend'], fetcher=self.fetcher)
+            logger.info("{}: scraped {}/{} articles".format(
+                self.name, min(start + batch_size, len(pending)), len(pending)))
+            yield True
+        logger.info("{}: done".format(self.name))
+
+
+def load_config(path):
+    """
+    Reads the config file, returns the global settings and the per site configs
+    with the global settings filled in
+    """
+    with open(path, 'r') as config_file:
+        config = json.load(config_file)
+    settings = dict(DEFAULTS)
+    settings.update((name, value) for name, value in config.items() if name != 'sites')
+    sites = []
+    for site_config in config['sites']:
+        site = dict(settings)
+        site.update(site_config)
+        sites.append(site)
+    return settings, sites
+
+
+def build_sites(settings, site_configs, cache=None):
+    """
+    Builds a Site for every config. Sites on the same domain share one Fetcher (and so its
+    rate limit and throttle), and all fetchers share max_concurrent_requests request slots
+    """
+    slots = threading.BoundedSemaphore(settings['max_concurrent_requests'])
+    fetchers = {}
+    sites = []
+    for config in site_configs:
+        domain = urlsplit(config['archives_root_url']).hostname
+        if domain not in fetchers:
+            fetchers[domain] = Fetcher(workers=config['per_domain_concurrency'],
+                requests_per_second=config['requests_per_second'],
+                throttle=AdaptiveThrottle(delay=config['throttle_delay']), cache=cache, slots=slots,
+                retries=config['retries'])
+        sites.append(Site(config, fetchers[domain]))
+    return sites
+
+
+def run_sites(sites, max_parallel_sites=4):
+    """
+    Round robin scheduler: steps of up to max_parallel_sites sites run at the same time, never two
+    of the same domain, and a site goes to the back of the queue after each of its steps.
+    A site whose step fails is dropped (its progress is kept for the next run), the others carry on
+    """
+    ready = deque(sites)
+    running = {}
+    busy_domains = set()
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_parallel_sites) as executor:
+        while ready or running:
+            for _ in range(len(ready)):
+                if len(running) >= max_parallel_sites:
+                    break
+                site = ready.popleft()
+                if site.domain in busy_domains:
+                    ready.append(site)
+                    continue
+                busy_domains.add(site.domain)
+                running[executor.submit(site.step)] = site
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                site = running.pop(future)
+                busy_domains.discard(site.domain)
+                try:
+                    if future.result():
+                        ready.append(site)
+                except Exception:
+                    logger.exception("{}: failed, it will resume from here on the next run".format(site.name))
+                    failed.append(site.name)
+    return failed
+
+
+def run_config(path, cache=None):
+    settings, site_configs = load_config(path)
+    sites = build_sites(settings, site_configs, cache=cache)
+    failed = run_sites(sites, max_parallel_sites=settings['max_parallel_sites'])
+    logger.info("Done with {} sites, {} failed {}".format(len(sites), len(failed), failed))
+    return failed
+
+
+if __name__ == '__main__':
+    setup_logging()
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "sites.json"
+    with MetricsExporter(["orchestrator_metrics.json", "orchestrator_metrics.prom"]):
+        failed = run_config(config_path)
+    sys.exit(1 if failed else 0)
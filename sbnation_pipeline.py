@@ -0,0 +1,192 @@
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+
+from sbnation_article_content_scraper import (
+    ArticleSkipped, add_article, article_fields, fetch_article, write_articles_to_file
+)
+from sbnation_article_store import ArticleIndex, is_article_store
+from sbnation_html_extraction import extract_article_timed
+from sbnation_http import Fetcher
+from sbnation_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_FEEDER_DONE = object()
+
+
+def _ignore_sigint():
+    # Ctrl-C is handled by the main process, which shuts the parser processes down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class _Pipeline(object):
+    """
+    Fetcher threads -> parser processes -> single writer (the calling thread).
+    At most max_in_flight articles are between being fetched and being written, which bounds
+    the raw html held in memory and makes the fetchers wait for slow parsers (backpressure)
+    """
+    def __init__(self, fetcher, fetch_workers, parse_processes, max_in_flight, backend):
+        self.fetcher = fetcher
+        self.backend = backend
+        self.results = queue.Queue()
+        self.stopped = threading.Event()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.fetch_executor = ThreadPoolExecutor(max_workers=fetch_workers)
+        self.parse_executor = ProcessPoolExecutor(max_workers=parse_processes, initializer=_ignore_sigint)
+        # the pool forks all its processes on the first submit, which has to happen here before the fetcher
+        # and feeder threads exist: a child forked while another thread holds a lock can deadlock on it
+        self.parse_executor.submit(os.getpid).result()
+        self.submitted = 0
+
+    def feed(self, pending):
+        """
+        Runs in its own thread, submits the fetches of (key, url) pairs as in flight slots free up
+        """
+        try:
+            for key, url in pending:
+                while not self.in_flight.acquire(timeout=0.5):
+                    if self.stopped.is_set():
+                        return
+                if self.stopped.is_set():
+                    self.in_flight.release()
+                    return
+                self.submitted += 1
+                future = self.fetch_executor.submit(fetch_article, self.fetcher, url)
+                future.add_done_callback(lambda fetched, key=key: self._on_fetched(key, fetched))
+        except RuntimeError:
+            # the executors were shut down under us by a Ctrl-C
+            pass
+        finally:
+            self.results.put(_FEEDER_DONE)
+
+    def _on_fetched(self, key, fetched):
+        if fetched.cancelled():
+            self.results.put((key, None, ArticleSkipped(key, "cancelled")))
+            return
+        error = fetched.exception()
+        if error is not None:
+            self.results.put((key, None, ArticleSkipped(key, "fetch_error")))
+            return
+        response = fetched.result()
+        if isinstance(response, ArticleSkipped):
+            self.results.put((key, None, response))
+            return
+        try:
+            start = time.perf_counter()
+            parsed = self.parse_executor.submit(extract_article_timed, response.content, self.backend)
+        except RuntimeError:
+            self.results.put((key, None, ArticleSkipped(key, "cancelled")))
+            return
+        parsed.add_done_callback(
+            lambda parsed, key=key, status=response.status_code: self._on_parsed(key, status, parsed, start))
+
+    def _on_parsed(self, key, status_code, parsed, start):
+        metrics.observe('parse_stage', time.perf_counter() - start)
+        if parsed.cancelled():
+            self.results.put((key, None, ArticleSkipped(key, "cancelled")))
+        elif parsed.exception() is not None:
+            self.results.put((key, None, ArticleSkipped(key, "parse_error")))
+        else:
+            # the parser processes have their own copy of the metrics, their parse times are recorded here
+            extracted, parse_seconds = parsed.result()
+            metrics.observe('parse', parse_seconds, page='article')
+            self.results.put((key, status_code, extracted))
+
+    def shutdown(self):
+        self.stopped.set()
+        self.fetch_executor.shutdown(wait=True, cancel_futures=True)
+        self.parse_executor.shutdown(wait=True, cancel_futures=True)
+
+
+def scrap_content_pipelined(article_infos, articles, outfile_path,
+    fetch_workers=8, parse_processes=None, max_in_flight=None, checkpoint_every=500,
+    requests_per_second=None, burst=1, throttle=None, backend="html.parser", cache=None):
+    """
+    Same as sbnation_article_content_scraper.scrap_content, but with fetching, parsing and writing
+    running as separate stages: fetcher threads hand the raw html to a pool of parser processes,
+    whose results are added to articles and checkpointed by the calling thread.
+    The parse stage therefore scales with the number of cores instead of being held by the GIL.
+    Articles are added in the order they finish, not in the order of article_infos.
+    On Ctrl-C the articles finished so far are written to outfile_path before KeyboardInterrupt is re-raised
+    :param: parse_processes : number of parser processes (default: number of cores)
+    :param: max_in_flight : maximum number of articles fetched but not yet written
+    """
+    if isinstance(articles, ArticleIndex) and not is_article_store(outfile_path):
+        raise ValueError("Writing to json file {} needs all the articles loaded, "
+            "use an article store or load_bodies=True".format(outfile_path))
+    parse_processes = parse_processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 4 * (fetch_workers + parse_processes)
+    fetcher = Fetcher(workers=fetch_workers, requests_per_second=requests_per_second, burst=burst,
+        throttle=throttle, cache=cache)
+    pending = [(key, article_infos[key]['url']) for key in article_infos if key not in articles]
+    logger.info("Started pipelined scraping of {} articles with {} fetchers and {} parser processes".format(
+        len(pending), fetch_workers, parse_processes))
+
+    pipeline = _Pipeline(fetcher, fetch_workers, parse_processes, max_in_flight, backend)
+    feeder = threading.Thread(target=pipeline.feed, args=(pending,), daemon=True)
+    state = {"articles": articles, "unsaved_keys": [], "processed": 0,
+        "articles_skipped": 0, "summary_skipped": 0}
+
+    def handle(result):
+        key, status_code, extracted = result
+        state["processed"] += 1
+        try:
+            if isinstance(extracted, ArticleSkipped):
+                raise extracted
+            if extracted['summary'] is None:
+                state["summary_skipped"] += 1
+                metrics.inc('summaries_skipped')
+            value = article_infos[key]
+            author, body, summary = article_fields(value, status_code, extracted)
+            state["articles"] = add_article(state["articles"], key, value['date'], value['title'], value['url'],
+                author, body, summary or "")
+            state["unsaved_keys"].append(key)
+            metrics.inc('articles_scraped')
+        except ArticleSkipped as error:
+            state["articles_skipped"] += 1
+            metrics.inc('articles_skipped', reason=error.reason)
+
+    feeder_done = False
+    feeder.start()
+    try:
+        while not feeder_done or state["processed"] < pipeline.submitted:
+            try:
+                result = pipeline.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if result is _FEEDER_DONE:
+                feeder_done = True
+                continue
+            handle(result)
+            pipeline.in_flight.release()
+            if state["processed"] % checkpoint_every == 0:
+                write_articles_to_file(state["articles"], outfile_path, state["unsaved_keys"])
+                state["unsaved_keys"] = []
+                logger.info("Total Processed articles = {}/{}, Skipped Articles = {} Skipped Summaries = {}".format(
+                    state["processed"], len(pending), state["articles_skipped"], state["summary_skipped"]))
+    except KeyboardInterrupt:
+        logger.info("Interrupted, stopping the pipeline and saving the articles finished so far")
+        raise
+    finally:
+        pipeline.shutdown()
+        feeder.join()
+        # keep whatever was finished while the pipeline was shutting down
+        while True:
+            try:
+                result = pipeline.results.get_nowait()
+            except queue.Empty:
+                break
+            if result is not _FEEDER_DONE and not isinstance(result[2], ArticleSkipped):
+                handle(result)
+        write_articles_to_file(state["articles"], outfile_path, state["unsaved_keys"])
+
+    articles = state["articles"]
+    logger.info("Total articles skipped {}".format(state["articles_skipped"]))
+    logger.info("Total summaries skipped {}".format(state["summary_skipped"]))
+    logger.info("Wrote final {} articles into {}".format(len(articles), outfile_path))
+    return articles
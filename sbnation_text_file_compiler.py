@@ -1,70 +1,106 @@
-from sbnation_article_content_scraper import (
-    get_existing_articles, print_progress_bar
-)
+from sbnation_article_store import iter_articles, open_article_index
+from sbnation_metrics import metrics
 import logging
+from sbnation_logging import setup_logging
 
-# create logger with 'this modules name'
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-# create file handler which logs even debug messages
-fh = logging.handlers.RotatingFileHandler(__name__+'.log', 
-    mode='w', maxBytes=1e7, backupCount=4)
-fh.setLevel(logging.DEBUG)
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
 
-# create a detailed and simple formatter and add it to the handlers
-detailed_formatter = logging.Formatter(fmt=
-    ("%(asctime)-22s - %(name)-4s - %(levelname)-4s - "
-    "%(filename)-5s - %(lineno)-2s - "
-    "%(funcName)-5s \n%(message)s")
-)
-simple_formatter = logging.Formatter('%(name)s: %(levelname)s: %(message)s')
+def _normalize_author(author):
+    return author.lower().strip()
 
-fh.setFormatter(detailed_formatter)
-ch.setFormatter(simple_formatter)
-# add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
 
+def article_block(article):
+    """
+    Returns the text of an article with the boundary tokens around it, as it is written to the text files
+    """
+    return "".join(("<|startoftext|>\n", article['content'], "\n<|endoftext|>\n"))
 
-def write_to_txt_file(text, output_txt_file_path):
-    with open(output_txt_file_path, 'w', encoding='utf-8') as outfile:
-        outfile.write(text)
-    logger.info("Done writing to file {}, text length = {}".format(output_txt_file_path, len(text)))
+
+def iter_articles_by_authors(json_file_path, authors):
+    """
+    Yields (key, article) for the articles written by one of authors (normalized names).
+    Authors are matched using the article index only, so the content of the other
+    articles is never read
+    """
+    index = open_article_index(json_file_path)
+    for key, metadata in index.items():
+        if _normalize_author(metadata['author']) in authors:
+            yield key, index.load_article(key)
+
+
+def compile_txt_files(json_file_path, outputs):
+    """
+    Compiles the articles in json_file_path (a json file or an article store directory)
+    into several text files in a single pass. Every article is streamed straight to the
+    output files it belongs to, so memory use does not grow with the size of the corpus
+    :param: outputs : dictionary of author : output text file path,
+    use None as the author for a file containing articles from all authors
+    """
+    logger.info("Compiling articles in {} to text files {}".format(json_file_path, outputs))
+    outfiles_by_author = {}
+    outfiles_for_all = []
+    written = {}
+    try:
+        for author, output_txt_file_path in outputs.items():
+            outfile = open(output_txt_file_path, 'w', encoding='utf-8')
+            written[output_txt_file_path] = 0
+            if author is None:
+                outfiles_for_all.append((output_txt_file_path, outfile))
+            else:
+                outfiles_by_author.setdefault(_normalize_author(author), []).append(
+                    (output_txt_file_path, outfile))
+
+        if outfiles_for_all:
+            articles = iter_articles(json_file_path)
+        else:
+            articles = iter_articles_by_authors(json_file_path, set(outfiles_by_author))
+        i = 0
+        for key, article in articles:
+            i += 1
+            # After every 500 articles are read, log progress
+            if i%500 == 0:
+                logger.info("Total articles read = {}".format(i))
+            targets = outfiles_by_author.get(_normalize_author(article['author']), [])
+            if not targets and not outfiles_for_all:
+                continue
+            block = article_block(article)
+            for output_txt_file_path, outfile in outfiles_for_all + targets:
+                outfile.write(block)
+                written[output_txt_file_path] += 1
+            metrics.inc('articles_compiled')
+            metrics.inc('characters_compiled', len(block))
+    finally:
+        for output_txt_file_path, outfile in outfiles_for_all + [
+                target for targets in outfiles_by_author.values() for target in targets]:
+            outfile.close()
+
+    for output_txt_file_path, count in written.items():
+        logger.info("Done writing to file {}, number of articles = {}".format(output_txt_file_path, count))
+    return written
 
 
 def compile_txt_file(json_file_path, output_txt_file_path, author=None):
     logger.info("Compiling articles in {} to text file at {} where author is {}".
         format(json_file_path, output_txt_file_path, author))
-    articles = get_existing_articles(json_file_path)
-    text = ""
-    _max = len(articles)
-    i = 0
-    # Initial call to print 0% progress
-    print_progress_bar(0, _max, prefix = 'Progress:', suffix = 'Complete', length = 100)
-    for key in articles:
-        # After every 500 article_infos are added, log and update progress bar
-        if i%500 == 0:
-            print_progress_bar(i, _max, prefix='Progress:', suffix='Complete', length=100)
-            logger.info("Total articles added to string = {}".format(i))
-        if (author and author.lower().strip() == articles[key]['author'].lower().strip()) or author is None:
-            i += 1
-            text = ''.join((text, "<|startoftext|>\n", articles[key]['content'], "\n<|endoftext|>\n"))
-    write_to_txt_file(text, output_txt_file_path)
+    compile_txt_files(json_file_path, {author: output_txt_file_path})
 
 
 if __name__ == "__main__":
+    setup_logging()
     json_file_path = "scrapped_data/mm/mm_articles.json"
-    output_txt_file_path = "scrapped_data/mm/mm_text_lucas.txt"
 
-    # compile only articles from this author
-    # pass None to compile from all authors
-    author = "Lucas Navarrete" # or None
-    compile_txt_file(
+    # compile every author : output file pair in a single pass over the articles
+    # use None as the author to compile articles from all authors
+    outputs = {
+        "Lucas Navarrete": "scrapped_data/mm/mm_text_lucas.txt",
+        None: "scrapped_data/mm/mm_text_all.txt",
+    }
+    compile_txt_files(
         json_file_path=json_file_path,
-        output_txt_file_path=output_txt_file_path,
-        author = author
+        outputs=outputs
     )
+
+    # to also write a pre-tokenized dataset for training (needs numpy, and tiktoken for the gpt2 tokenizer):
+    # from sbnation_token_dataset import compile_token_dataset
+    # compile_token_dataset(json_file_path, "scrapped_data/mm/mm_tokens", tokenizer="gpt2")
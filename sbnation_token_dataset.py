@@ -0,0 +1,218 @@
+"""
+Pre-tokenized training dataset, so that fine-tuning jobs do not have to tokenize the text file on every run.
+
+compile_token_dataset writes, for each of the train and val splits:
+    <prefix>.<split>.bin         the uint16 token ids of all the articles one after the other
+    <prefix>.<split>.offsets.npy int64 offsets, article i is tokens[offsets[i]:offsets[i + 1]]
+    <prefix>.<split>.keys.npy    uint64 article keys (see sbnation_dedupe.article_key), in the same order
+and <prefix>.meta.json with the tokenizer and the number of articles and tokens.
+Every article is tokenized exactly as it appears in the text file written by sbnation_text_file_compiler,
+boundary tokens included. TokenDataset reads a split back with zero copy memory mapped slices.
+"""
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+import numpy as np
+
+from sbnation_article_store import iter_articles
+from sbnation_metrics import metrics
+from sbnation_text_file_compiler import article_block
+
+logger = logging.getLogger(__name__)
+
+SPLITS = ("train", "val")
+TOKEN_DTYPE = np.uint16
+
+
+class ByteTokenizer(object):
+    """
+    Tokenizer needing no vocabulary files: the tokens are the utf-8 bytes of the text
+    """
+    name = "bytes"
+    vocab_size = 256
+
+    def encode(self, text):
+        return np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+
+
+class TiktokenTokenizer(object):
+    """
+    GPT-2 byte pair encoding from tiktoken (pip install tiktoken)
+    """
+    def __init__(self, encoding_name="gpt2"):
+        try:
+            import tiktoken
+        except ImportError:
+            raise ImportError("The gpt2 tokenizer needs tiktoken (pip install tiktoken), "
+                "the 'bytes' tokenizer works without it")
+        self.name = encoding_name
+        self._encoding = tiktoken.get_encoding(encoding_name)
+        self.vocab_size = self._encoding.n_vocab
+
+    def encode(self, text):
+        # <|endoftext|> in the articles blocks is the gpt2 end of text token, not plain text
+        return self._encoding.encode(text, allowed_special="all")
+
+
+# name : zero argument factory, add your own tokenizer here or pass a picklable factory instead of a name.
+# A tokenizer has a name, a vocab_size (at most 65536 for uint16 tokens) and encode(text) returning token ids
+TOKENIZERS = {
+    "bytes": ByteTokenizer,
+    "gpt2": TiktokenTokenizer,
+}
+
+
+def get_tokenizer(tokenizer):
+    """
+    Returns the tokenizer named tokenizer in TOKENIZERS, or the one built by calling it
+    """
+    factory = TOKENIZERS[tokenizer] if isinstance(tokenizer, str) else tokenizer
+    return factory()
+
+
+def split_of(key, val_fraction):
+    """
+    Deterministic split of an article, decided by the hash of its key so that an article
+    stays in the same split when the dataset is rebuilt with more articles
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return "val" if int.from_bytes(digest, 'big') < val_fraction * 2 ** 64 else "train"
+
+
+def key_to_int(key):
+    """
+    Article keys are 16 hex characters, older hash keys are folded to 64 bits
+    """
+    try:
+        return int(key, 16) & 0xffffffffffffffff
+    except ValueError:
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = get_tokenizer(tokenizer)
+
+
+def _tokenize_batch(texts):
+    return [np.asarray(_worker_tokenizer.encode(text), dtype=TOKEN_DTYPE) for text in texts]
+
+
+def _iter_batches(articles, batch_size):
+    batch = []
+    for key, article in articles:
+        batch.append((key, article_block(article)))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _SplitWriter(object):
+
+    def __init__(self, prefix, split):
+        self.prefix = "{}.{}".format(prefix, split)
+        self.tokens_file = open(self.prefix + '.bin', 'wb')
+        self.offsets = [0]
+        self.keys = []
+
+    def add(self, key, tokens):
+        tokens.tofile(self.tokens_file)
+        self.offsets.append(self.offsets[-1] + len(tokens))
+        self.keys.append(key_to_int(key))
+
+    def close(self):
+        self.tokens_file.close()
+        np.save(self.prefix + '.offsets.npy', np.asarray(self.offsets, dtype=np.int64))
+        np.save(self.prefix + '.keys.npy', np.asarray(self.keys, dtype=np.uint64))
+
+
+def compile_token_dataset(json_file_path, output_prefix, tokenizer="bytes", processes=None,
+    val_fraction=0.01, batch_size=256):
+    """
+    Tokenizes the articles in json_file_path (a json file or an article store directory) with
+    processes parallel worker processes and writes the memory mapped train and val splits
+    (see the module docstring). Articles are streamed, at most 2*processes batches are in flight
+    :param: tokenizer : name of a tokenizer in TOKENIZERS or a picklable factory returning one
+    :param: val_fraction : share of the articles going to the val split
+    """
+    main_tokenizer = get_tokenizer(tokenizer)
+    vocab_size = main_tokenizer.vocab_size
+    if vocab_size > np.iinfo(TOKEN_DTYPE).max + 1:
+        raise ValueError("Tokenizer vocabulary of {} tokens does not fit uint16 token ids".format(vocab_size))
+    processes = processes or os.cpu_count() or 1
+    logger.info("Tokenizing articles in {} to {} with {} processes".format(json_file_path, output_prefix, processes))
+    writers = dict((split, _SplitWriter(output_prefix, split)) for split in SPLITS)
+    executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(tokenizer,))
+    in_flight = deque()
+
+    def write_batch(keys, future):
+        with metrics.timer('tokenize_wait'):
+            token_arrays = future.result()
+        for key, tokens in zip(keys, token_arrays):
+            writers[split_of(key, val_fraction)].add(key, tokens)
+            metrics.inc('tokens_compiled', len(tokens))
+        metrics.inc('articles_tokenized', len(keys))
+
+    try:
+        for batch in _iter_batches(iter_articles(json_file_path), batch_size):
+            keys = [key for key, _ in batch]
+            in_flight.append((keys, executor.submit(_tokenize_batch, [text for _, text in batch])))
+            if len(in_flight) >= 2 * processes:
+                write_batch(*in_flight.popleft())
+        while in_flight:
+            write_batch(*in_flight.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for writer in writers.values():
+            writer.close()
+
+    meta = {"tokenizer": main_tokenizer.name, "vocab_size": vocab_size,
+        "dtype": np.dtype(TOKEN_DTYPE).name, "val_fraction": val_fraction,
+        "splits": dict((split, {"articles": len(writer.keys), "tokens": writer.offsets[-1]})
+            for split, writer in writers.items())}
+    with open(output_prefix + '.meta.json', 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    logger.info("Wrote token dataset {}: {}".format(output_prefix, meta["splits"]))
+    return meta
+
+
+class TokenDataset(object):
+    """
+    One split of a dataset written by compile_token_dataset. dataset[i] is the token array of
+    article i, a view into the memory mapped token file (nothing is read until it is used)
+    """
+    def __init__(self, prefix, split="train"):
+        path = "{}.{}".format(prefix, split)
+        with open(prefix + '.meta.json', 'r') as meta_file:
+            self.meta = json.load(meta_file)
+        self.offsets = np.load(path + '.offsets.npy', mmap_mode='r')
+        self.keys = np.load(path + '.keys.npy', mmap_mode='r')
+        if self.offsets[-1] > 0:
+            self.tokens = np.memmap(path + '.bin', dtype=self.meta['dtype'], mode='r')
+        else:
+            # numpy cannot memory map an empty file
+            self.tokens = np.zeros(0, dtype=self.meta['dtype'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def key(self, i):
+        return "{:016x}".format(int(self.keys[i]))
+
+    def sample(self, rng, count):
+        """
+        Returns the token arrays of count articles chosen uniformly at random with the numpy Generator rng
+        """
+        return [self[i] for i in rng.integers(0, len(self), size=count)]
@@ -0,0 +1,71 @@
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+# the sbnation modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the connection is closed without an answer, the client gets a requests.ConnectionError
+DROP = object()
+
+
+class FixtureSite(object):
+    """
+    A local website answering from the pages dict: path -> markup (bytes), an http status (int)
+    or DROP. Every other path is a 404. The requested paths are recorded in requests
+    """
+    def __init__(self):
+        self.pages = {}
+        self.requests = []
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                site.requests.append(self.path)
+                page = site.pages.get(self.path, 404)
+                if page is DROP:
+                    self.close_connection = True
+                    return
+                if isinstance(page, int):
+                    self.send_response(page)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.root_url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+        self.archives_url = self.root_url + "archives/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def article_url(self, year, month, number):
+        return "{}{}/{}/{}/{}/article-{}".format(self.root_url, year, month, 1 + number % 28, number, number)
+
+    def archive_page(self, year, month, numbers):
+        """
+        An archive page listing the articles numbers of year-month, without bylines
+        """
+        entries = ['<div class="c-entry-box--compact__body"><h2 class="c-entry-box--compact__title">'
+            '<a href="{}">Article {}</a></h2></div>'.format(self.article_url(year, month, number), number)
+            for number in numbers]
+        return '<html><body>{}</body></html>'.format(''.join(entries)).encode()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def site():
+    fixture_site = FixtureSite()
+    yield fixture_site
+    fixture_site.close()
@@ -0,0 +1,68 @@
+import json
+
+from conftest import DROP
+from sbnation_archive_crawler import crawl_archive_month, scrape_from_sbnation_http
+from sbnation_http import AdaptiveThrottle, Fetcher
+from sbnation_http_cache import ResponseCache
+from sbnation_metrics import metrics
+
+
+def serve_month(site, year, month, pages):
+    """
+    pages lists the article numbers of every archive page of the month
+    """
+    for page, numbers in enumerate(pages, 1):
+        path = "/archives/{}/{}".format(year, month) + ("/{}".format(page) if page > 1 else "")
+        site.pages[path] = site.archive_page(year, month, numbers)
+
+
+def fast_throttle():
+    return AdaptiveThrottle(delay=0.001, min_delay=0.001)
+
+
+def urls(article_infos):
+    return sorted(value['url'] for value in article_infos.values())
+
+
+def test_stops_after_the_last_page(site):
+    serve_month(site, 2019, 1, [range(0, 5), range(5, 10)])
+    article_infos = crawl_archive_month(1, 2019, Fetcher(), site.archives_url, {})
+    assert urls(article_infos) == sorted(site.article_url(2019, 1, number) for number in range(10))
+    assert site.requests == ["/archives/2019/1", "/archives/2019/1/2", "/archives/2019/1/3"]
+
+
+def test_stops_at_an_empty_page(site):
+    serve_month(site, 2019, 1, [range(0, 5), [], range(10, 15)])
+    article_infos = crawl_archive_month(1, 2019, Fetcher(), site.archives_url, {})
+    assert len(article_infos) == 5
+    assert "/archives/2019/1/3" not in site.requests
+
+
+def test_month_with_a_request_error_is_skipped(tmp_path, site):
+    metrics.reset()
+    serve_month(site, 2019, 1, [range(0, 5)])
+    site.pages["/archives/2019/1/2"] = DROP
+    serve_month(site, 2019, 2, [range(5, 10)])
+    list_path = str(tmp_path / "list.json")
+    article_infos = scrape_from_sbnation_http([1, 2], [2019], list_path, {}, site.archives_url,
+        throttle=fast_throttle(), retries=0)
+    # the entries of the first page of the failing month are kept
+    assert len(article_infos) == 10
+    with open(list_path) as list_file:
+        assert json.load(list_file) == article_infos
+    assert metrics.snapshot()["counters"]['archive_month_errors{reason="ConnectionError"}'] == 1
+
+
+def test_offline_cache_miss_ends_the_month(tmp_path, site):
+    serve_month(site, 2019, 1, [range(0, 5), range(5, 10)])
+    cache_path = str(tmp_path / "cache")
+    online = scrape_from_sbnation_http([1], [2019], str(tmp_path / "online.json"), {}, site.archives_url,
+        throttle=fast_throttle(), cache=ResponseCache(cache_path))
+    requests_made = len(site.requests)
+
+    offline = scrape_from_sbnation_http([1], [2019], str(tmp_path / "offline.json"), {}, site.archives_url,
+        throttle=fast_throttle(), cache=ResponseCache(cache_path, offline=True))
+    assert len(online) == 10
+    assert offline == online
+    # the 404 after the last page is not cached, offline it is a miss which ends the month
+    assert len(site.requests) == requests_made
@@ -0,0 +1,35 @@
+import os
+
+from sbnation_article_content_scraper import get_existing_articles, scrap_content
+from sbnation_dedupe import article_key
+from sbnation_http import Fetcher
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def article_infos_for(site, numbers):
+    article_infos = {}
+    for number in numbers:
+        url = site.article_url(2019, 10, number)
+        article_infos[article_key(url)] = {"date": "2019-10-{:02d}".format(1 + number % 28),
+            "title": "Article {}".format(number), "url": url, "author": "unknown"}
+    return article_infos
+
+
+def test_scraping_into_a_new_store_only_keeps_the_unsaved_articles(tmp_path, site):
+    with open(os.path.join(FIXTURES_DIR, "article.html"), 'rb') as html_file:
+        markup = html_file.read()
+    article_infos = article_infos_for(site, range(3))
+    for value in article_infos.values():
+        site.pages[value['url'][len(site.root_url) - 1:]] = markup
+    store_path = str(tmp_path / "articles")
+
+    articles = get_existing_articles(store_path, load_bodies=False)
+    scrap_content(article_infos, articles, store_path, fetcher=Fetcher())
+    assert len(articles) == 3
+    # the articles were released at the checkpoint and are read back from the store
+    assert articles._added == {}
+    for key in article_infos:
+        assert articles[key]['author'] == "Gill Clark"
+        assert "Then Suárez found Messi" in articles.load_article(key)['content']
+    assert sorted(get_existing_articles(store_path, load_bodies=False)) == sorted(article_infos)
@@ -0,0 +1,133 @@
+import json
+import socket
+
+import pytest
+
+import sbnation
+from sbnation_article_list_scraper import get_existing_articles_list, harvest_archive_month
+from sbnation_http import AdaptiveThrottle
+
+ARCHIVES_URL = "https://www.example.com/archives/"
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_missing_list(tmp_path):
+    assert get_existing_articles_list(str(tmp_path / "list.json")) == {}
+
+
+def test_empty_list(tmp_path):
+    list_path = tmp_path / "list.json"
+    list_path.write_text("{}")
+    assert get_existing_articles_list(str(list_path)) == {}
+
+
+def test_list_runs_after_a_run_finding_nothing(tmp_path):
+    list_path = tmp_path / "list.json"
+    argv = ['--no-log-file', 'list', '--archives-url', 'http://127.0.0.1:{}/archives/'.format(closed_port()),
+        '--years', '2019', '--months', '1', '--retries', '0', '--out', str(list_path)]
+    assert sbnation.main(argv) == 0
+    assert json.loads(list_path.read_text()) == {}
+    # the empty list written by the first run is picked up again
+    assert sbnation.main(argv) == 0
+
+
+def test_list_offline_needs_cache(tmp_path):
+    with pytest.raises(SystemExit):
+        sbnation.main(['--no-log-file', 'list', '--archives-url', 'http://127.0.0.1/archives/',
+            '--years', '2019', '--offline', '--out', str(tmp_path / "list.json")])
+
+
+def test_list_offline_from_the_cache(tmp_path, site):
+    site.pages["/archives/2019/1"] = site.archive_page(2019, 1, range(5))
+    argv = ['--no-log-file', 'list', '--archives-url', site.archives_url, '--years', '2019', '--months', '1',
+        '--cache', str(tmp_path / "cache")]
+    assert sbnation.main(argv + ['--out', str(tmp_path / "online.json")]) == 0
+    site.pages.clear()
+    requests_made = len(site.requests)
+    assert sbnation.main(argv + ['--offline', '--out', str(tmp_path / "offline.json")]) == 0
+    assert len(site.requests) == requests_made
+    online = json.loads((tmp_path / "online.json").read_text())
+    assert len(online) == 5
+    assert json.loads((tmp_path / "offline.json").read_text()) == online
+
+
+class StubDriver(object):
+    """
+    Archive page of a month listing the article numbers, which loads per_click more entries
+    on every load more click. Once break_at entries are loaded the button stops working until
+    the page is refreshed, and the refreshed page starts over with the first entries
+    """
+    def __init__(self, numbers, per_click=20, break_at=40):
+        self.numbers = list(numbers)
+        self.per_click = per_click
+        self.break_at = break_at
+        self.loaded = 0
+        self.refreshes = 0
+        self.broken = False
+
+    def get(self, url):
+        self.loaded = self.per_click
+
+    def refresh(self):
+        self.refreshes += 1
+        self.loaded = self.per_click
+        self.broken = False
+
+    def find_elements_by_class_name(self, class_name):
+        return ["load more"] if self.loaded < len(self.numbers) else []
+
+    def execute_script(self, script, *args):
+        if 'click()' in script:
+            self.loaded = min(len(self.numbers), self.loaded + self.per_click)
+            self.broken = self.refreshes == 0 and self.loaded >= self.break_at
+        elif not script.startswith('window.scrollTo'):
+            return [["Article {}".format(number), article_url(number), None, None]
+                for number in self.numbers[args[0]:self.loaded]]
+
+
+class StubWait(object):
+    def __init__(self, driver, timeout):
+        self.driver = driver
+
+    def until(self, condition):
+        if self.driver.broken:
+            raise Exception("load more button is not clickable")
+        return True
+
+
+def article_url(number):
+    return "https://www.example.com/2019/3/{}/{}/article-{}".format(1 + number % 28, number, number)
+
+
+@pytest.fixture
+def stub_wait(monkeypatch):
+    pytest.importorskip("selenium")
+    monkeypatch.setattr("selenium.webdriver.support.ui.WebDriverWait", StubWait)
+
+
+def harvest(driver, article_infos, incremental):
+    return harvest_archive_month(3, 2019, driver, ARCHIVES_URL, article_infos,
+        throttle=AdaptiveThrottle(delay=0.001, min_delay=0.001), incremental=incremental)
+
+
+def test_harvest_keeps_loading_after_a_refresh(stub_wait):
+    driver = StubDriver(range(95))
+    article_infos = harvest(driver, {}, incremental=False)
+    assert driver.refreshes == 1
+    assert sorted(value['url'] for value in article_infos.values()) == sorted(article_url(n) for n in range(95))
+
+
+def test_incremental_harvest_stops_at_the_articles_known_before_the_run(stub_wait):
+    article_infos = harvest(StubDriver(range(95), break_at=200), {}, incremental=False)
+    # 50 new articles on top of the month, loading more breaks after the first 40 of them
+    driver = StubDriver(list(range(100, 150)) + list(range(95)))
+    article_infos = harvest(driver, article_infos, incremental=True)
+    assert driver.refreshes == 1
+    assert len(article_infos) == 145
+    # the page after the one mixing new and known articles only has known ones
+    assert driver.loaded == 80
@@ -0,0 +1,63 @@
+"""
+Every parser backend has to extract exactly the same values as html.parser from the fixture pages
+"""
+import os
+
+import pytest
+
+from sbnation_html_extraction import (
+    BACKENDS, available_backends, check_backend_conformance, extract_archive_entries, extract_article
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+PAGES = ("article.html", "article_without_header.html", "archive.html")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as html_file:
+        return html_file.read()
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    if request.param not in available_backends():
+        pytest.skip("{} is not installed".format(request.param))
+    return request.param
+
+
+def test_article(backend):
+    article = extract_article(read_fixture("article.html"), backend)
+    assert article["summary"] == "A Clásico decided by Messi & a late header — again"
+    assert article["author"] == "Gill Clark"
+    assert "Then Suárez found Messi at the edge of the box — and that was that." in article["body"]
+    assert "Ter Stegen: 7" in article["body"]
+    assert "What a goal \U0001F410" in article["body"]
+    # the scripts and stylesheets inside the content are not part of the text
+    assert "trackEmbed" not in article["body"]
+    assert ".tweet" not in article["body"]
+
+
+def test_header_classes_match_exactly(backend):
+    article = extract_article(read_fixture("article_without_header.html"), backend)
+    assert article["summary"] is None
+    assert article["author"] is None
+    assert article["body"] == "Listen below.Transcript to follow."
+
+
+def test_archive_entries(backend):
+    entries = extract_archive_entries(read_fixture("archive.html"), backend)
+    assert entries == [
+        ("Barcelona 2-1 Real Madrid: Five things we learned",
+            "https://www.barcablaugranes.com/2019/10/26/20933321/barcelona-real-madrid-five-things",
+            "Gill Clark", "2019-10-26T18:30:00+00:00"),
+        ("Preview: El Clásico & the return of Suárez",
+            "https://www.barcablaugranes.com/2019/10/25/20932000/preview-clásico",
+            "Luis Mazariegos", "2019-10-25T09:00:00+00:00"),
+        ("Daily Links: Slavia Prague away",
+            "https://www.barcablaugranes.com/2019/10/24/20931000/daily-links", None, None),
+    ]
+
+
+def test_backends_conform_on_every_page(backend):
+    markups = [read_fixture(name) for name in PAGES]
+    assert check_backend_conformance(markups, [backend]) == []
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from sbnation_job_ledger import DEAD, DONE, FAILED, PENDING, JobLedger
+
+
+def infos(*keys):
+    return dict((key, {"url": "https://www.example.com/{}".format(key)}) for key in keys)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    job_ledger = JobLedger(str(tmp_path / "ledger.sqlite"), max_attempts=3, retry_backoff=60.0)
+    yield job_ledger
+    job_ledger.close()
+
+
+def test_sync_after_rekeying(ledger):
+    assert ledger.sync(infos("a", "b"), {}) == 2
+    # nothing to do for the same article list
+    assert ledger.sync(infos("a", "b"), {}) == 0
+    # the list was rekeyed, the new keys are added (as done if their articles exist already)
+    assert ledger.sync(infos("a2", "b2"), {"a2": {}}) == 2
+    assert ledger.counts() == {PENDING: 3, DONE: 1}
+    # the old keys are kept, scrap_content skips the outstanding keys missing from the list
+    assert ledger.outstanding() == ["a", "b", "b2"]
+
+
+def test_sync_is_kept_across_reopening(tmp_path):
+    path = str(tmp_path / "ledger.sqlite")
+    first = JobLedger(path)
+    first.sync(infos("a", "b"), {})
+    first.close()
+    second = JobLedger(path)
+    assert second.sync(infos("a", "b"), {}) == 0
+    assert second.sync(infos("a", "b", "c"), {}) == 1
+    second.close()
+
+
+def test_outstanding_with_retry_failed_only(ledger):
+    ledger.sync(infos("a", "b", "c"), {})
+    ledger.mark_done("a")
+    ledger.mark_failed("b", "fetch_error")
+    later = time.time() + 3600
+    assert ledger.outstanding(now=later) == ["b", "c"]
+    assert ledger.outstanding(retry_failed_only=True, now=later) == ["b"]
+
+
+def test_permanent_reasons_are_dead(ledger):
+    ledger.sync(infos("a", "b", "c"), {})
+    ledger.mark_failed("a", "status_404")
+    ledger.mark_failed("b", "no_body")
+    ledger.mark_failed("c", "fetch_error", permanent=True)
+    assert ledger.counts() == {DEAD: 3}
+    assert ledger.failures() == {"status_404": 1, "no_body": 1, "fetch_error": 1}
+    assert ledger.outstanding(now=time.time() + 10 ** 9) == []
+    assert ledger.revive("no_body") == 1
+    assert ledger.outstanding() == ["b"]
+
+
+def test_backoff_doubles_until_max_attempts(ledger):
+    ledger.sync(infos("a"), {})
+    for attempt in range(2):
+        before = time.time()
+        ledger.mark_failed("a", "fetch_error")
+        after = time.time()
+        backoff = 60.0 * 2 ** attempt
+        assert ledger.counts() == {FAILED: 1}
+        assert ledger.outstanding(now=before + backoff - 1) == []
+        assert ledger.outstanding(now=after + backoff) == ["a"]
+    # the third failure reaches max_attempts
+    ledger.mark_failed("a", "fetch_error")
+    assert ledger.counts() == {DEAD: 1}
+    assert ledger.outstanding(now=time.time() + 10 ** 9) == []
@@ -0,0 +1,40 @@
+import json
+
+import sbnation_orchestrator
+from conftest import DROP
+
+
+def write_config(tmp_path, site, **settings):
+    config = {"requests_per_second": None, "throttle_delay": 0.001, "retries": 0,
+        "sites": [dict({"name": "s", "archives_root_url": site.archives_url, "years": [2019, 2019],
+            "months": [1, 2], "output_dir": str(tmp_path / "s")}, **settings)]}
+    config_path = tmp_path / "sites.json"
+    config_path.write_text(json.dumps(config))
+    return str(config_path)
+
+
+def read_json(path):
+    with open(str(path)) as json_file:
+        return json.load(json_file)
+
+
+def test_failing_month_is_skipped_and_crawled_again(tmp_path, site):
+    site.pages["/archives/2019/1"] = DROP
+    site.pages["/archives/2019/2"] = site.archive_page(2019, 2, [1, 2])
+    config_path = write_config(tmp_path, site)
+    assert sbnation_orchestrator.run_config(config_path) == []
+    assert len(read_json(tmp_path / "s" / "s_article_list.json")) == 2
+    assert read_json(tmp_path / "s" / "progress.json")["listed_months"] == ["2019-2"]
+
+    site.pages["/archives/2019/1"] = site.archive_page(2019, 1, [3])
+    assert sbnation_orchestrator.run_config(config_path) == []
+    assert len(read_json(tmp_path / "s" / "s_article_list.json")) == 3
+    assert sorted(read_json(tmp_path / "s" / "progress.json")["listed_months"]) == ["2019-1", "2019-2"]
+
+
+def test_rerun_after_an_empty_month(tmp_path, site):
+    # no archive pages at all, the first run writes an empty article list
+    config_path = write_config(tmp_path, site, months=[1, 1])
+    assert sbnation_orchestrator.run_config(config_path) == []
+    assert read_json(tmp_path / "s" / "s_article_list.json") == {}
+    assert sbnation_orchestrator.run_config(config_path) == []
@@ -0,0 +1,37 @@
+import os
+
+from sbnation_article_content_scraper import scrap_content
+from sbnation_dedupe import article_key
+from sbnation_http import Fetcher
+from sbnation_pipeline import _Pipeline, scrap_content_pipelined
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def test_parser_processes_are_started_before_any_fetch():
+    pipeline = _Pipeline(Fetcher(), fetch_workers=2, parse_processes=2, max_in_flight=4, backend="html.parser")
+    try:
+        assert len(pipeline.parse_executor._processes) == 2
+        assert pipeline.submitted == 0
+    finally:
+        pipeline.shutdown()
+
+
+def test_pipelined_scrape_matches_the_serial_one(tmp_path, site):
+    with open(os.path.join(FIXTURES_DIR, "article.html"), 'rb') as html_file:
+        markup = html_file.read()
+    article_infos = {}
+    for number in range(6):
+        url = site.article_url(2019, 10, number)
+        article_infos[article_key(url)] = {"date": "2019-10-01", "title": "Article {}".format(number),
+            "url": url, "author": "unknown"}
+        # one missing article page
+        if number != 3:
+            site.pages[url[len(site.root_url) - 1:]] = markup
+
+    serial = {}
+    scrap_content(article_infos, serial, str(tmp_path / "serial.json"), fetcher=Fetcher())
+    pipelined = scrap_content_pipelined(article_infos, {}, str(tmp_path / "pipelined.json"),
+        fetch_workers=2, parse_processes=2, checkpoint_every=2)
+    assert len(pipelined) == 5
+    assert pipelined == serial
@@ -0,0 +1,32 @@
+import json
+import os
+
+import sbnation
+from sbnation_article_store import ArticleStore
+
+ARTICLES = {
+    "a": {"date": "2019-10-26", "title": "A", "url": "https://www.example.com/a", "author": "Gill Clark",
+        "content": "A\nBy Gill Clark\nBody"},
+    "b": {"date": "2019-11-02", "title": "B", "url": "https://www.example.com/b", "author": "Luis Mazariegos",
+        "content": "B\nBy Luis Mazariegos\nBody"},
+}
+
+
+def test_stats_of_a_json_file_and_a_store_agree(tmp_path, capsys):
+    json_path = str(tmp_path / "articles.json")
+    with open(json_path, 'w') as json_file:
+        json.dump(ARTICLES, json_file)
+    store = ArticleStore(str(tmp_path / "articles"))
+    for key, article in ARTICLES.items():
+        store.append(key, article)
+    store.commit()
+
+    outputs = []
+    for path in (json_path, store.directory):
+        assert sbnation.main(['--no-log-file', 'stats', path]) == 0
+        outputs.append(capsys.readouterr().out.split("\n", 1))
+    assert outputs[0][0] == json_path + ": 2 articles"
+    assert outputs[0][1] == outputs[1][1]
+    assert "'Gill Clark': 1" in outputs[0][1]
+    # the metadata index of the json file is reused by the next run
+    assert os.path.isfile(json_path + ".index.jsonl")